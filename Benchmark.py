@@ -0,0 +1,238 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import cv2
+import Detector
+import VACSColumns
+import VACSEncoder
+import VACSParser
+
+
+class Results:
+
+    # Flat name -> {'value', 'unit', 'better'} map, written as JSON so runs
+    # can be compared with compare()
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, value, unit, better):
+        self.metrics[name] = {'value': value, 'unit': unit, 'better': better}
+        print(format(name, '<48') + format(value, '>14.4f') + ' ' + unit)
+
+    def add_rate(self, name, seconds, count, size):
+        self.add(name + '/MBps', size / seconds / 1e6, 'MB/s', 'higher')
+        self.add(name + '/packets_per_s', count / seconds, 'packets/s', 'higher')
+
+    def add_latency(self, name, samples):
+        # samples in seconds, reported in milliseconds
+        self.add(name + '/mean', float(np.mean(samples)) * 1e3, 'ms', 'lower')
+        self.add(name + '/p50', float(np.percentile(samples, 50)) * 1e3, 'ms', 'lower')
+        self.add(name + '/p95', float(np.percentile(samples, 95)) * 1e3, 'ms', 'lower')
+
+
+def measure(function, min_time=0.2, min_runs=5):
+    # Seconds per call of function(), one sample per run
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_runs or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def measure_batch(function, min_time=0.2):
+    # Mean seconds per call of a function too cheap to time one call at a time
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / calls
+        calls *= 2
+
+
+def bench_parser(results, log_path, message_definition_path, parse_bytes):
+    with open(log_path, 'rb') as log_file:
+        data = log_file.read()
+
+    parser = VACSParser.Parser(message_definition_path)
+    sample = data[:parse_bytes]
+    start = time.perf_counter()
+    for i in range(len(sample)):
+        parser.parse(sample[i:i + 1])
+    results.add_rate('parser/parse', time.perf_counter() - start,
+                     parser.correct_message_count, len(sample))
+
+    for chunk_size in (64, 4096, len(data)):
+        parser = VACSParser.Parser(message_definition_path)
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk_size):
+            parser.feed(data[offset:offset + chunk_size])
+        results.add_rate('parser/feed_' + str(chunk_size if chunk_size < len(data) else 'whole'),
+                         time.perf_counter() - start, parser.correct_message_count, len(data))
+
+    start = time.perf_counter()
+    records = VACSColumns.frame(data)
+    results.add_rate('parser/columns_frame', time.perf_counter() - start, len(records), len(data))
+    start = time.perf_counter()
+    VACSColumns.decode(parser.decoder, data, records)
+    results.add_rate('parser/columns_decode', time.perf_counter() - start, len(records), len(data))
+
+
+def sample_message(message_def):
+    # Field values inside the definition's range, plus four sequence blocks
+    def values(names, types, mins=None):
+        output = {}
+        for k, (name, field_type) in enumerate(zip(names, types)):
+            low = mins[k] if mins is not None and mins[k] is not None else 0
+            output[name] = float(low) if field_type == 'float' else int(low)
+        return output
+
+    if message_def.message_id == 125:
+        return {'fcs/msg_code': 1, 'fcs/msg_text': 'benchmark message'}
+    message = values(message_def.field_names, message_def.field_types, message_def.field_mins)
+    if message_def.sequence is not None:
+        sequence = message_def.sequence
+        block = values(sequence.field_names, sequence.field_types)
+        message[sequence.name] = [dict(block) for _ in range(4)]
+    return message
+
+
+def bench_codec(results, message_definition_path):
+    parser = VACSParser.Parser(message_definition_path)
+    decoder = parser.decoder
+    for message_id in sorted(decoder.messages):
+        message_def = decoder.messages[message_id]
+        message = sample_message(message_def)
+        try:
+            payload = decoder.createMessagePayload(message_id, message)
+        except (KeyError, TypeError, ValueError, OverflowError) as error:
+            print("skipping", message_id, message_def.name, error)
+            continue
+        packet = VACSParser.Parser.Packet(1, 2, message_id, bytes(payload), decoder)
+        name = 'codec/' + str(message_id)
+        results.add(name + '/decode', measure_batch(lambda: decoder.decode(packet)) * 1e6,
+                    'us', 'lower')
+        results.add(name + '/encode',
+                    measure_batch(lambda: decoder.createMessagePayload(message_id, message)) * 1e6,
+                    'us', 'lower')
+        results.add(name + '/packet',
+                    measure_batch(lambda: parser.create_message_packet(message_id, message, 1, 2)) * 1e6,
+                    'us', 'lower')
+
+    batch = [(message_id, sample_message(decoder.messages[message_id]), 1, 2)
+             for message_id in sorted(decoder.messages)] * 2
+    encoder = VACSEncoder.Encoder(decoder)
+    results.add('codec/batch/create_message_packet', measure_batch(
+        lambda: b''.join(parser.create_message_packet(*packet) for packet in batch)) * 1e6,
+        'us', 'lower')
+    results.add('codec/batch/encoder', measure_batch(lambda: encoder.encode(batch)) * 1e6, 'us', 'lower')
+
+    for size in (16, 64, 256, 1024):
+        data = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+        results.add('checksum/' + str(size),
+                    measure_batch(lambda: parser.compute_checksum(data)) * 1e6, 'us', 'lower')
+
+
+def synthetic_frame(width, height, targets, size=60, seed=0):
+    # Dark noisy background with white square tents on a grid
+    random = np.random.RandomState(seed)
+    image = random.randint(0, 120, (height, width, 3)).astype(np.uint8)
+    columns = max(1, width // (2 * size))
+    for k in range(targets):
+        x = (k % columns) * 2 * size + size // 2
+        y = (k // columns) * 2 * size + size // 2
+        image[y:y + size, x:x + size] = 255
+    return image
+
+
+def bench_detector(results, resolutions, target_counts):
+    detector = Detector.Detector()
+    for width, height in resolutions:
+        for targets in target_counts:
+            image = synthetic_frame(width, height, targets)
+            found = len(detector.detect(image))
+            if found != targets:
+                print("warning:", width, height, "found", found, "of", targets, "targets")
+            name = 'detector/' + str(width) + 'x' + str(height) + '/' + str(targets)
+            results.add_latency(name + '/full', measure(lambda: detector.detect(image)))
+            results.add_latency(name + '/coarse_to_fine',
+                                measure(lambda: detector.detect_coarse_to_fine(image)))
+            # What find_whiterec_fame runs per frame: tracker and overlay
+            tracker = Detector.Tracker(detector)
+
+            def frame():
+                copy = image.copy()
+                Detector.draw_detections(copy, tracker.detect(copy))
+            results.add_latency(name + '/tracker', measure(frame))
+
+
+def compare(metrics, baseline, tolerance):
+    # Names of metrics more than tolerance (a fraction) worse than baseline
+    regressions = []
+    for name, old in baseline.items():
+        new = metrics.get(name)
+        if new is None or not old['value']:
+            continue
+        change = (new['value'] - old['value']) / abs(old['value'])
+        if old['better'] == 'higher':
+            change = -change
+        if change > tolerance:
+            regressions.append((name, old['value'], new['value'], change))
+    return regressions
+
+
+def main(argv):
+    arguments = argparse.ArgumentParser(description="Parser, codec and detector benchmarks")
+    arguments.add_argument('--log', default='plane_10.dat')
+    arguments.add_argument('--definition', default='FCSPlaneDefinition_Aries_FCS.xml')
+    arguments.add_argument('--output', default='benchmark.json')
+    arguments.add_argument('--baseline', help="earlier output to compare against")
+    arguments.add_argument('--tolerance', type=float, default=0.2,
+                           help="allowed slowdown against the baseline (default 0.2 = 20%%)")
+    arguments.add_argument('--parse-bytes', type=int, default=200000,
+                           help="bytes of the log fed to the per-byte parser")
+    arguments.add_argument('--only', choices=('parser', 'codec', 'detector'), action='append')
+    options = arguments.parse_args(argv)
+    sections = options.only or ('parser', 'codec', 'detector')
+
+    results = Results()
+    if 'parser' in sections:
+        bench_parser(results, options.log, options.definition, options.parse_bytes)
+    if 'codec' in sections:
+        bench_codec(results, options.definition)
+    if 'detector' in sections:
+        bench_detector(results, [(320, 240), (640, 480), (1280, 720), (1920, 1080)], (0, 1, 4))
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'metrics': results.metrics,
+    }
+    with open(options.output, 'w') as output_file:
+        json.dump(report, output_file, indent=1, sort_keys=True)
+    print("Wrote", options.output)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['metrics']
+        regressions = compare(results.metrics, baseline, options.tolerance)
+        for name, old, new, change in regressions:
+            print("REGRESSION", name, old, "->", new, format(change * 100, '+.0f') + '%')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
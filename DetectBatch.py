@@ -0,0 +1,187 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import cv2
+import numpy as np
+import Detector
+
+
+# Offline tent detection over a video file or a directory of saved frames
+# (e.g. the positive/ and negative/ folders of ImageStore), spread over a
+# process pool. Each worker decodes its own frames -- a video segment it
+# seeks to, or a list of image files -- on a prefetch thread while the
+# previous frame is being detected, so only detections are sent back.
+# Results come back in frame order.
+
+detection_dtype = np.dtype([
+    ('frame', '<i8'),
+    ('x', '<i4'),
+    ('y', '<i4'),
+    ('w', '<i4'),
+    ('h', '<i4'),
+    ('width', '<f4'),
+    ('distance', '<f4'),
+])
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp')
+worker_detector = None
+worker_scale = None
+
+
+def init_worker(settings, scale):
+    global worker_detector, worker_scale
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+    worker_detector = Detector.Detector(**settings)
+    worker_scale = scale
+
+
+def prefetch(frames, depth=4):
+    # Iterate frames on a background thread, at most depth ahead
+    items = queue.Queue(depth)
+
+    def run():
+        for frame in frames:
+            items.put(frame)
+        items.put(None)
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        frame = items.get()
+        if frame is None:
+            break
+        yield frame
+
+
+def video_frames(path, start, count):
+    capture = cv2.VideoCapture(path)
+    if start:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frame_id = start
+    while count is None or frame_id < start + count:
+        ok, image = capture.read()
+        if not ok:
+            break
+        yield frame_id, image
+        frame_id += 1
+    capture.release()
+
+
+def image_frames(paths, start):
+    for frame_id, path in enumerate(paths, start):
+        image = cv2.imread(path)
+        if image is not None:
+            yield frame_id, image
+
+
+def detect_frames(frames):
+    rows = []
+    for frame_id, image in prefetch(frames):
+        if worker_scale is None:
+            detections = worker_detector.detect(image)
+        else:
+            detections = worker_detector.detect_coarse_to_fine(image, worker_scale)
+        for detection in detections:
+            (x, y, w, h) = detection.box
+            rows.append((frame_id, x, y, w, h, detection.width, detection.distance))
+    return np.array(rows, dtype=detection_dtype)
+
+
+def detect_task(task):
+    if task[0] == 'video':
+        return detect_frames(video_frames(task[1], task[2], task[3]))
+    return detect_frames(image_frames(task[1], task[2]))
+
+
+def image_paths(directory):
+    # Frames of a directory and its subdirectories in name order
+    paths = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(image_extensions):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths
+
+
+def tasks_for(source, segment_frames=300, batch_files=32):
+    if os.path.isdir(source):
+        paths = image_paths(source)
+        return paths, [('images', paths[k:k + batch_files], k)
+                       for k in range(0, len(paths), batch_files)]
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError("cannot open " + source)
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    # The reported frame count can be short; the last segment reads to the end
+    starts = list(range(0, max(frame_count, 1), segment_frames))
+    tasks = [('video', source, start, segment_frames) for start in starts]
+    tasks[-1] = ('video', source, starts[-1], None)
+    return None, tasks
+
+
+def detect_source(source, settings=None, scale=None, processes=None, segment_frames=300):
+    # Structured detection_dtype array for every tent in source. For a
+    # directory, frame is the index into the returned sorted path list.
+    paths, tasks = tasks_for(source, segment_frames)
+    with multiprocessing.Pool(processes, init_worker, (settings or {}, scale)) as pool:
+        parts = pool.map(detect_task, tasks, chunksize=1)
+    detections = np.concatenate(parts) if parts else np.zeros(0, dtype=detection_dtype)
+    return detections, paths
+
+
+def write_csv(path, detections, paths=None):
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(('frame', 'file', 'x', 'y', 'w', 'h', 'width', 'distance'))
+        for row in detections.tolist():
+            name = paths[row[0]] if paths is not None else ''
+            writer.writerow((row[0], name) + tuple(row[1:]))
+
+
+def main(argv):
+    arguments = argparse.ArgumentParser(description="Detect tents in a video file or image directory")
+    arguments.add_argument('source')
+    arguments.add_argument('output', help="detections as .csv or .npy")
+    arguments.add_argument('--processes', type=int)
+    arguments.add_argument('--segment-frames', type=int, default=300,
+                           help="video frames per pool task")
+    arguments.add_argument('--coarse', type=float,
+                           help="coarse to fine search at this scale, as the tracker does")
+    arguments.add_argument('--tent-width', type=float, default=20)
+    arguments.add_argument('--focal-length', type=float, default=415.15)
+    arguments.add_argument('--threshold', type=int, default=235)
+    arguments.add_argument('--epsilon', type=float, default=0.14)
+    arguments.add_argument('--min-area', type=float, default=1500)
+    arguments.add_argument('--min-ratio', type=float, default=0.65)
+    arguments.add_argument('--max-ratio', type=float, default=1.35)
+    options = arguments.parse_args(argv)
+
+    settings = {
+        'tent_width': options.tent_width,
+        'focal_length': options.focal_length,
+        'threshold': options.threshold,
+        'epsilon': options.epsilon,
+        'min_area': options.min_area,
+        'min_ratio': options.min_ratio,
+        'max_ratio': options.max_ratio,
+    }
+    detections, paths = detect_source(options.source, settings, options.coarse,
+                                      options.processes, options.segment_frames)
+    if options.output.endswith('.npy'):
+        np.save(options.output, detections)
+        if paths is not None:
+            with open(options.output[:-4] + '.files', 'w') as files:
+                files.write('\n'.join(paths) + '\n')
+    else:
+        write_csv(options.output, detections, paths)
+    frames = len(np.unique(detections['frame']))
+    print(len(detections), "detections in", frames, "frames ->", options.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,194 @@
+import threading
+import cv2
+import imutils
+
+
+def dis_to_camera(Width, focalLength, perWidth):
+    # compute and return the distance from the maker to the camer
+    return (Width * focalLength) / perWidth
+
+
+class Detection:
+
+    def __init__(self, contour, box, width, distance):
+        self.contour = contour
+        self.box = box  # (x, y, w, h) of the approximated quadrilateral
+        self.width = width  # minAreaRect width in pixels
+        self.distance = distance
+
+    def __str__(self):
+        return "Detection(box=" + str(self.box) + ",width=" + str(self.width) + ",distance=" + str(self.distance) + ")"
+
+
+class Detector:
+
+    # White rectangle (tent) detector used by final.py
+
+    def __init__(self, tent_width=20, focal_length=415.15, threshold=235,
+                 epsilon=0.14, min_area=1500, min_ratio=0.65, max_ratio=1.35):
+        self.tent_width = tent_width
+        self.focal_length = focal_length
+        self.threshold = threshold
+        self.epsilon = epsilon
+        self.min_area = min_area  # arbitrary; the area of the largest object on the test image / 2
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+
+    def detect(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return self.detect_gray(gray)
+
+    def detect_gray(self, gray, origin=(0, 0)):
+        # origin shifts the contours when gray is a window of the frame
+        thresh = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY)[1]
+        cnts = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                offset=origin)
+        cnts = imutils.grab_contours(cnts)
+        detections = []
+        for c in cnts:
+            detection = self.check_contour(c)
+            if detection is not None:
+                detections.append(detection)
+        return detections
+
+    def check_contour(self, c):
+        area = cv2.contourArea(c)
+        if area <= self.min_area:
+            return None
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, self.epsilon * peri, True)
+        if len(approx) != 4:
+            return None
+        (x, y, w, h) = cv2.boundingRect(approx)
+        r = w / float(h)
+        if r < self.min_ratio or r > self.max_ratio:
+            return None
+        marker = cv2.minAreaRect(c)
+        distance = dis_to_camera(self.tent_width, self.focal_length, marker[1][0])
+        return Detection(c, (x, y, w, h), marker[1][0], distance)
+
+    def detect_window(self, img, window):
+        (x0, y0, x1, y1) = window
+        gray = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        return self.detect_gray(gray, (x0, y0))
+
+    def find_candidates(self, img, scale):
+        # Bright, roughly square blobs on a downscaled copy of img, returned
+        # as full resolution (x, y, w, h). The limits are looser than
+        # check_contour so that nothing the full check would accept is lost.
+        small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        thresh = cv2.threshold(gray, self.threshold, 255, cv2.THRESH_BINARY)[1]
+        cnts = imutils.grab_contours(cv2.findContours(
+            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE))
+        min_area = self.min_area * scale * scale * 0.5
+        candidates = []
+        for c in cnts:
+            (x, y, w, h) = cv2.boundingRect(c)
+            if w * h < min_area:
+                continue
+            r = w / float(h)
+            if r < self.min_ratio * 0.5 or r > self.max_ratio * 2:
+                continue
+            candidates.append((x / scale, y / scale, w / scale, h / scale))
+        return candidates
+
+    def detect_coarse_to_fine(self, img, scale=0.25):
+        # Screen a downscaled frame, then run the full check only inside the
+        # candidate windows. A blob edge is only known to within a coarse
+        # pixel, so each window gets a margin of a few coarse pixels.
+        if scale >= 1:
+            return self.detect(img)
+        pad = 2 / scale + 2
+        windows = [expand_box(box, pad, img.shape) for box in self.find_candidates(img, scale)]
+        detections = []
+        for window in merge_windows(windows):
+            detections.extend(self.detect_window(img, window))
+        return detections
+
+
+def expand_box(box, pad, shape):
+    # (x, y, w, h) grown by pad on every side and clipped to the frame, as
+    # an integer (x0, y0, x1, y1) window
+    (x, y, w, h) = box
+    x0 = max(0, int(x - pad))
+    y0 = max(0, int(y - pad))
+    x1 = min(shape[1], int(x + w + pad + 1))
+    y1 = min(shape[0], int(y + h + pad + 1))
+    return (x0, y0, x1, y1)
+
+
+def merge_windows(windows):
+    # Union overlapping windows so no contour is found twice
+    merged = []
+    for window in windows:
+        (x0, y0, x1, y1) = window
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if other[0] < x1 and x0 < other[2] and other[1] < y1 and y0 < other[3]:
+                    merged.remove(other)
+                    x0, y0 = min(x0, other[0]), min(y0, other[1])
+                    x1, y1 = max(x1, other[2]), max(y1, other[3])
+                    overlapping = True
+                    break
+        merged.append((x0, y0, x1, y1))
+    return merged
+
+
+class Tracker:
+
+    # Follows confirmed targets from frame to frame. While a track exists
+    # only a window around each last known box is searched; a coarse to
+    # fine search of the whole frame runs every full_every frames, or as
+    # soon as the windows come up empty. detect() is a drop-in replacement
+    # for Detector.detect and may be called from several threads.
+
+    def __init__(self, detector, full_every=15, scale=0.25, search_margin=1.0):
+        self.detector = detector
+        self.full_every = full_every
+        self.scale = scale
+        self.search_margin = search_margin
+        self.lock = threading.Lock()
+        self.boxes = []
+        self.frames_since_full = 0
+        self.full_searches = 0
+        self.tracked_frames = 0
+        self.lost_count = 0
+
+    def detect(self, img):
+        with self.lock:
+            boxes = self.boxes
+            full = not boxes or self.frames_since_full >= self.full_every
+            self.frames_since_full = 0 if full else self.frames_since_full + 1
+
+        detections = None
+        if not full:
+            windows = [expand_box(box, max(box[2], box[3]) * self.search_margin, img.shape)
+                       for box in boxes]
+            detections = []
+            for window in merge_windows(windows):
+                detections.extend(self.detector.detect_window(img, window))
+            if not detections:
+                detections = None
+                with self.lock:
+                    self.lost_count += 1
+
+        if detections is None:
+            detections = self.detector.detect_coarse_to_fine(img, self.scale)
+            with self.lock:
+                self.full_searches += 1
+                self.frames_since_full = 0
+        else:
+            with self.lock:
+                self.tracked_frames += 1
+
+        with self.lock:
+            self.boxes = [detection.box for detection in detections]
+        return detections
+
+
+def draw_detections(img, detections):
+    for detection in detections:
+        cv2.drawContours(img, [detection.contour], -1, (0, 255, 0), 2)
@@ -0,0 +1,88 @@
+import math
+import threading
+import cv2
+
+
+class Governor:
+
+    # Decides in front of the detector which frames are worth detecting.
+    # Checks, cheapest first:
+    #   altitude  - below min_altitude the aircraft is on the ground; above
+    #               max_altitude a tent is smaller than the detector's
+    #               min_area (tent_width * focal_length / sqrt(min_area),
+    #               in the units of tent_width, like the altitude)
+    #   budget    - detection may use about cpu_budget of one core; the
+    #               running mean detect time sets the shortest interval
+    #               between admitted frames
+    #   unchanged - a subsampled copy of the frame barely differs from the
+    #               last admitted one; every max_unchanged-th such frame is
+    #               still admitted in case a target appeared
+    # altitude(timestamp) returns the altitude at capture time or None when
+    # unknown, in which case altitude gating is off.
+
+    reasons = ('altitude_low', 'altitude_high', 'budget', 'unchanged')
+
+    def __init__(self, altitude=None, tent_width=20, focal_length=415.15, min_area=1500,
+                 min_altitude=5.0, cpu_budget=0.5, change_threshold=2.0, max_unchanged=30,
+                 step=16):
+        self.altitude = altitude
+        self.min_altitude = min_altitude
+        self.max_altitude = tent_width * focal_length / math.sqrt(min_area)
+        self.cpu_budget = cpu_budget
+        self.change_threshold = change_threshold
+        self.max_unchanged = max_unchanged
+        self.step = step
+        self.lock = threading.Lock()
+        self.cost = 0.0
+        self.next_time = 0.0
+        self.thumbnail = None
+        self.unchanged_run = 0
+        self.processed = 0
+        self.skipped = {reason: 0 for reason in Governor.reasons}
+
+    def admit(self, frame):
+        reason = self.check(frame)
+        with self.lock:
+            if reason is None:
+                self.processed += 1
+            else:
+                self.skipped[reason] += 1
+        return reason is None
+
+    def check(self, frame):
+        if self.altitude is not None:
+            altitude = self.altitude(frame.capture_time)
+            if altitude is not None:
+                if altitude < self.min_altitude:
+                    return 'altitude_low'
+                if altitude > self.max_altitude:
+                    return 'altitude_high'
+
+        with self.lock:
+            if frame.capture_time < self.next_time:
+                return 'budget'
+
+        # Every step-th pixel of the green channel is enough to tell a new
+        # view from a repeated one
+        thumbnail = frame.image[::self.step, ::self.step, 1]
+        with self.lock:
+            if self.thumbnail is not None and self.thumbnail.shape == thumbnail.shape:
+                change = cv2.mean(cv2.absdiff(thumbnail, self.thumbnail))[0]
+                if change < self.change_threshold and self.unchanged_run < self.max_unchanged:
+                    self.unchanged_run += 1
+                    return 'unchanged'
+            self.unchanged_run = 0
+            self.thumbnail = thumbnail.copy()
+            self.next_time = frame.capture_time + self.cost / self.cpu_budget
+        return None
+
+    def done(self, seconds):
+        # Detect time of an admitted frame, smoothed over about ten frames
+        with self.lock:
+            self.cost = seconds if not self.cost else self.cost + 0.1 * (seconds - self.cost)
+
+    def __str__(self):
+        return ("Governor(processed=" + str(self.processed) + "," +
+                ",".join(reason + "=" + str(self.skipped[reason]) for reason in Governor.reasons) +
+                ",detect_ms=" + format(self.cost * 1000, '.1f') +
+                ",max_altitude=" + format(self.max_altitude, '.0f') + ")")
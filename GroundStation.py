@@ -0,0 +1,155 @@
+import asyncio
+import sys
+import time
+import VACSParser
+import VACSTransport
+
+
+class Aircraft:
+
+    # Latest known state of one VACS source address. state holds the most
+    # recent value of every decoded field and is updated in place.
+
+    def __init__(self, src_addr, link_name):
+        self.src_addr = src_addr
+        self.link_name = link_name
+        self.state = {}
+        self.updated = {}
+        self.packets = 0
+        self.first_seen = None
+        self.last_seen = None
+
+    def update(self, timestamp, message_id, message):
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.packets += 1
+        self.state.update(message)
+        self.updated[message_id] = timestamp
+
+    def __str__(self):
+        age = time.time() - self.last_seen if self.last_seen is not None else float('nan')
+        return ("Aircraft(src=" + str(self.src_addr) + ",link=" + self.link_name +
+                ",packets=" + str(self.packets) + ",age_s=" + format(age, '.1f') +
+                ",lat=" + str(self.state.get('position/latitude')) +
+                ",lon=" + str(self.state.get('position/longitude')) +
+                ",alt=" + str(self.state.get('position/altitude')) + ")")
+
+
+class GroundStation:
+
+    # Any number of VACS links served from one asyncio loop, each with its
+    # own Parser. Packets are demultiplexed by src_addr into Aircraft
+    # tables, so several airframes can share a radio or each have their own.
+    #
+    # stream() hands out a queue of (time, link name, packet) tuples merged
+    # from every link. Packets are stamped when their chunk is read and
+    # queued in the order the loop reads them, so each stream is time
+    # ordered. A consumer that falls behind loses packets (counted in
+    # dropped) instead of stalling the links and the tables.
+
+    def __init__(self, message_definition_path, queue_size=256):
+        self.message_definition_path = message_definition_path
+        self.queue_size = queue_size
+        self.links = []
+        self.tasks = []
+        self.aircraft = {}
+        self.streams = []
+        self.dropped = 0
+
+    def parser(self):
+        return VACSParser.Parser(self.message_definition_path)
+
+    async def add_link(self, destination):
+        # Serial port or pty path, udp:host:port to listen on, or
+        # tcp:host:port to connect to (e.g. VACSReplay)
+        if destination.startswith('udp:') or destination.startswith('tcp:'):
+            host, _, port = destination[4:].rpartition(':')
+            open_link = VACSTransport.open_udp if destination.startswith('udp:') else VACSTransport.open_connection
+            link = await open_link(host or '127.0.0.1', int(port), self.parser(),
+                                   queue_size=self.queue_size)
+        else:
+            link = await VACSTransport.open_serial(destination, self.parser(),
+                                                   queue_size=self.queue_size)
+        self.links.append(link)
+        self.tasks.append(asyncio.ensure_future(self.consume(link)))
+        return link
+
+    async def consume(self, link):
+        async for packet in link:
+            self.handle(time.time(), link, packet)
+
+    def handle(self, timestamp, link, packet):
+        aircraft = self.aircraft.get(packet.src_addr)
+        if aircraft is None:
+            aircraft = self.aircraft[packet.src_addr] = Aircraft(packet.src_addr, link.name)
+        aircraft.link_name = link.name
+        aircraft.update(timestamp, packet.message_id, packet.message)
+        for stream in self.streams:
+            try:
+                stream.put_nowait((timestamp, link.name, packet))
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def stream(self, queue_size=1024):
+        stream = asyncio.Queue(queue_size)
+        self.streams.append(stream)
+        return stream
+
+    def send(self, src_addr, message_id, message_data, own_addr=0):
+        # Uplink to one aircraft over the link it was last heard on
+        aircraft = self.aircraft[src_addr]
+        for link in self.links:
+            if link.name == aircraft.link_name:
+                link.send(message_id, message_data, own_addr, src_addr)
+                return True
+        return False
+
+    async def close(self):
+        for link in self.links:
+            await link.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def main(message_definition_path, destinations):
+    station = GroundStation(message_definition_path)
+    for destination in destinations:
+        await station.add_link(destination)
+    stream = station.stream()
+    target_report = station.links[0].parser.get_message_id('Target Report')
+
+    async def print_targets():
+        while True:
+            timestamp, link_name, packet = await stream.get()
+            if packet.message_id == target_report and packet.message:
+                message = packet.message
+                print("Target", message['target/id'], "from", packet.src_addr, "on", link_name,
+                      "lat", message['target/latitude'], "lon", message['target/longitude'],
+                      "(new)" if message['target/flags'] & 1 else "")
+
+    def report():
+        for src_addr in sorted(station.aircraft):
+            print(station.aircraft[src_addr])
+        for link in station.links:
+            print(link.name, "bytes_in:", link.bytes_in, "packets:", link.parser.correct_message_count,
+                  "checksum_errors:", link.parser.checksum_error_count)
+
+    printer = asyncio.ensure_future(print_targets())
+    try:
+        await VACSTransport.periodic(5.0, report)
+    finally:
+        printer.cancel()
+        await station.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python GroundStation.py message-definition-path link [link ...]")
+        print("  link: serial port or pty path, udp:host:port (listen) or tcp:host:port (connect)")
+        sys.exit(1)
+    try:
+        asyncio.run(main(sys.argv[1], sys.argv[2:]))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,165 @@
+import collections
+import json
+import os
+import queue
+import threading
+import time
+import cv2
+
+
+class ImageStore:
+
+    # Background JPEG writer for detection frames.
+    #
+    # submit() only decides whether a frame is kept (every positive, one in
+    # negative_every negatives) and queues it; encoding and writing happen on
+    # the worker threads. Files go to <root>/positive and <root>/negative and
+    # the oldest ones are deleted once the store holds more than max_bytes.
+    # Each written frame gets one JSON line in <root>/manifest.jsonl with its
+    # time, position and distance.
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, negative_every=30, workers=2,
+                 queue_size=8, jpeg_quality=90):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.negative_every = negative_every
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.files = collections.deque()
+        self.total_bytes = 0
+        self.negative_count = 0
+        self.submitted = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.written = 0
+        self.evicted = 0
+        self.failed = 0
+        self.write_histogram = None
+
+        for kind in ('positive', 'negative'):
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+        self.load_existing()
+        self.manifest = open(os.path.join(root, 'manifest.jsonl'), 'a')
+
+        self.threads = [threading.Thread(target=self.run, name='imagestore' + str(i), daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def load_existing(self):
+        # Files left by earlier flights count against the budget, oldest first
+        existing = []
+        for kind in ('positive', 'negative'):
+            directory = os.path.join(self.root, kind)
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    existing.append((stat.st_mtime, entry.path, stat.st_size))
+        existing.sort()
+        for _, path, size in existing:
+            self.files.append((path, size))
+            self.total_bytes += size
+
+    def submit(self, image, positive, metadata):
+        # Never blocks; returns whether the frame was queued for writing
+        self.submitted += 1
+        if not positive:
+            self.negative_count += 1
+            if self.negative_every <= 0 or (self.negative_count - 1) % self.negative_every:
+                self.skipped += 1
+                return False
+        try:
+            self.queue.put_nowait((image, positive, metadata))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            image, positive, metadata = item
+            start = time.perf_counter()
+            ok, encoded = cv2.imencode('.jpg', image, self.encode_params)
+            if ok:
+                try:
+                    self.write(encoded.tobytes(), positive, metadata)
+                except OSError as error:
+                    # A full or failing card loses this frame, not the worker
+                    with self.lock:
+                        self.failed += 1
+                    print("ImageStore: write failed:", error)
+            if self.write_histogram is not None:
+                self.write_histogram.record(time.perf_counter() - start)
+
+    def instrument(self, registry):
+        # Encode and write time per frame, plus the counters as gauges
+        self.write_histogram = registry.histogram('imagestore/write')
+        registry.gauge('imagestore/queue', self.queue.qsize)
+        for counter in ('submitted', 'written', 'skipped', 'dropped', 'evicted', 'failed',
+                        'total_bytes'):
+            registry.gauge('imagestore/' + counter, lambda counter=counter: getattr(self, counter))
+
+    def write(self, data, positive, metadata):
+        kind = 'positive' if positive else 'negative'
+        stamp = metadata.get('time', time.time())
+        name = 'img' + str(int(stamp * 1000)) + '_' + str(metadata.get('frame_id', 0)) + '.jpg'
+        path = os.path.join(self.root, kind, name)
+        with self.lock:
+            self.evict(len(data))
+            self.files.append((path, len(data)))
+            self.total_bytes += len(data)
+        try:
+            with open(path, 'wb') as image_file:
+                image_file.write(data)
+        except OSError:
+            with self.lock:
+                if (path, len(data)) in self.files:
+                    self.files.remove((path, len(data)))
+                    self.total_bytes -= len(data)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        entry = dict(metadata)
+        entry['file'] = kind + '/' + name
+        entry['bytes'] = len(data)
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            self.manifest.write(line)
+            self.manifest.flush()
+            self.written += 1
+
+    def evict(self, incoming):
+        while self.files and self.total_bytes + incoming > self.max_bytes:
+            path, size = self.files.popleft()
+            self.total_bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def close(self):
+        # A worker that has died cannot take its sentinel, so only wait for
+        # queue space while some worker is still there to make it
+        for _ in self.threads:
+            while any(thread.is_alive() for thread in self.threads):
+                try:
+                    self.queue.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+        for thread in self.threads:
+            thread.join()
+        self.manifest.close()
+
+    def __str__(self):
+        return ("ImageStore(submitted=" + str(self.submitted) + ",written=" + str(self.written) +
+                ",skipped=" + str(self.skipped) + ",dropped=" + str(self.dropped) +
+                ",evicted=" + str(self.evicted) + ",failed=" + str(self.failed) +
+                ",bytes=" + str(self.total_bytes) + ")")
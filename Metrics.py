@@ -0,0 +1,241 @@
+import json
+import os
+import socket
+import threading
+import time
+
+
+# Runtime metrics. Nothing here is used unless a Registry is created and
+# attached (Parser.probe, Pipeline.instrument, ImageStore.instrument); the
+# instrumented code only checks for None, so with metrics off the hot paths
+# run as before. from_environment() turns them on when VACS_METRICS is set.
+#
+# Updates take no locks. Counts from threads racing on the same counter or
+# bucket can very occasionally be lost, which is fine for monitoring.
+
+
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+
+    # HDR-style log-linear histogram of integer microseconds: exact below
+    # 2 ** sub_bits, then sub_buckets (32) per power of two, so a bucket is
+    # at most 1 / 32 (about 3%) of its lowest value wide. record() is an
+    # index computation and a list increment.
+
+    sub_bits = 6
+    sub_buckets = 1 << (sub_bits - 1)
+
+    def __init__(self, max_bits=40):
+        self.counts = [0] * ((max_bits - Histogram.sub_bits + 2) * Histogram.sub_buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = int(seconds * 1e6)
+        if value < 0:
+            value = 0
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        shift = value.bit_length() - Histogram.sub_bits
+        if shift <= 0:
+            index = value
+        else:
+            index = shift * Histogram.sub_buckets + (value >> shift)
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+
+    @staticmethod
+    def bucket_value(index):
+        # Lowest value that falls in bucket index
+        if index < 2 * Histogram.sub_buckets:
+            return index
+        shift = index // Histogram.sub_buckets - 1
+        return (index % Histogram.sub_buckets + Histogram.sub_buckets) << shift
+
+    def percentile(self, fraction):
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return 0
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return Histogram.bucket_value(index)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count if self.count else 0.0,
+            'p50_us': self.percentile(0.5),
+            'p90_us': self.percentile(0.9),
+            'p99_us': self.percentile(0.99),
+            'max_us': self.max,
+        }
+
+
+class Registry:
+
+    # Named counters, histograms and gauges. A gauge is a function read at
+    # snapshot time, for state the code already keeps (error counters, queue
+    # depths), so it costs nothing between snapshots.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.start_time = time.time()
+
+    def counter(self, name):
+        with self.lock:
+            if name not in self.counters:
+                self.counters[name] = Counter()
+            return self.counters[name]
+
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def gauge(self, name, function):
+        with self.lock:
+            self.gauges[name] = function
+
+    def snapshot(self):
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = list(self.histograms.items())
+            gauges = list(self.gauges.items())
+        output = {
+            'time': time.time(),
+            'uptime': time.time() - self.start_time,
+            'counters': {name: counter.value for name, counter in counters},
+            'histograms': {name: histogram.snapshot() for name, histogram in histograms},
+            'gauges': {},
+        }
+        for name, function in gauges:
+            try:
+                output['gauges'][name] = function()
+            except Exception as error:
+                output['gauges'][name] = repr(error)
+        return output
+
+
+class ParserProbe:
+
+    # Attached as parser.probe: bytes and chunks fed, packets per message
+    # id, and decode time per message id. The parser's own error counters
+    # are read as gauges.
+
+    def __init__(self, registry, parser, name='parser'):
+        self.registry = registry
+        self.name = name
+        self.bytes_in = registry.counter(name + '/bytes_in')
+        self.chunks = registry.counter(name + '/chunks')
+        self.packets = {}
+        self.decode_times = {}
+        for counter in ('correct_message_count', 'sync_error_count', 'constraints_error_count',
+                        'checksum_error_count', 'unhandled_packet_count'):
+            registry.gauge(name + '/' + counter,
+                           lambda counter=counter: getattr(parser, counter))
+        parser.probe = self
+
+    def fed(self, size):
+        self.bytes_in.value += size
+        self.chunks.value += 1
+
+    def packet(self, message_id):
+        counter = self.packets.get(message_id)
+        if counter is None:
+            counter = self.packets[message_id] = self.registry.counter(
+                self.name + '/packets/' + str(message_id))
+        counter.value += 1
+
+    def decoded(self, message_id, seconds):
+        histogram = self.decode_times.get(message_id)
+        if histogram is None:
+            histogram = self.decode_times[message_id] = self.registry.histogram(
+                self.name + '/decode/' + str(message_id))
+        histogram.record(seconds)
+
+
+class Reporter:
+
+    # Writes a registry snapshot every interval seconds, as one JSON line
+    # appended to a file, or as one datagram to a UNIX socket when the
+    # destination is unix:<path>. A socket with no listener drops the
+    # snapshot rather than stalling anything.
+
+    def __init__(self, registry, destination, interval=1.0):
+        self.registry = registry
+        self.destination = destination
+        self.interval = interval
+        self.running = False
+        self.thread = None
+        self.socket = None
+        self.output = None
+        if destination.startswith('unix:'):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+        else:
+            self.output = open(destination, 'a')
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='metrics', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        deadline = time.time()
+        while self.running:
+            deadline += self.interval
+            time.sleep(max(0.0, deadline - time.time()))
+            self.write()
+
+    def write(self):
+        line = json.dumps(self.registry.snapshot(), sort_keys=True)
+        if self.socket is not None:
+            try:
+                self.socket.sendto(line.encode('ascii'), self.destination[5:])
+            except OSError:
+                pass
+        else:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
+        if self.socket is not None:
+            self.socket.close()
+        else:
+            self.output.close()
+
+
+def from_environment(variable='VACS_METRICS', interval=1.0):
+    # (registry, reporter) when the environment variable names a file or
+    # unix:<path>, else (None, None) and nothing gets instrumented
+    destination = os.environ.get(variable)
+    if not destination:
+        return None, None
+    registry = Registry()
+    return registry, Reporter(registry, destination, interval)
@@ -1,5 +1,6 @@
 import serial
 import sys
+import VACSEncoder
 import VACSParser
 
 if len(sys.argv) != 3:
@@ -51,3 +52,16 @@ message_buffer = parser.create_message_packet(message_id, message_data, my_tail_
 
 serial_port.write(message_buffer)
 serial_port.flush()
+
+# Test 3: Both messages again, packed into one buffer and one write
+
+encoder = VACSEncoder.Encoder(parser.decoder)
+
+message_buffer = encoder.encode([
+    (parser.get_message_id("message report"),
+     {'fcs/msg_code': 1, 'fcs/msg_text': "This is a test message"}, my_tail_number, 0),
+    (message_id, message_data, my_tail_number, 21),
+])
+
+serial_port.write(message_buffer)
+serial_port.flush()
@@ -15,15 +15,13 @@ parser = VACSParser.Parser(message_definition_path)
 
 while True:
 
-    serial_byte = serial_port.read(1)
+    # read1 returns what has arrived (up to 4096 bytes) instead of waiting
+    # for a full 4096
+    serial_chunk = serial_port.read1(4096)
 
-    if serial_byte:
+    if serial_chunk:
 
-        parser.parse(serial_byte)
-
-        new_packet = parser.get_packet()
-
-        if new_packet:
+        for new_packet in parser.feed(serial_chunk):
             print(new_packet)
             for i in new_packet.message:
                 print("  ", i, new_packet.message[i])
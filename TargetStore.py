@@ -0,0 +1,154 @@
+import math
+import threading
+
+meters_per_degree = 111320.0
+meters_per_foot = 0.3048
+# Target ids wrap below id_limit; the ids above it are left for detections
+# that could not be placed
+id_limit = 0xFF00
+
+
+def target_position(pose, detection, image_shape, focal_length):
+    # Ground position of a detection for a camera looking straight down
+    # with the top of the image towards the aircraft heading. The pixel
+    # offset from the image centre is scaled by dis_to_camera / focal
+    # length, with distances in feet like the altitude. Returns
+    # (None, None) until a position report has arrived.
+    latitude = pose.get('position/latitude')
+    longitude = pose.get('position/longitude')
+    if latitude is None or longitude is None:
+        return None, None
+    (x, y, w, h) = detection.box
+    feet_per_pixel = detection.distance / focal_length
+    right = (x + w / 2.0 - image_shape[1] / 2.0) * feet_per_pixel * meters_per_foot
+    forward = (image_shape[0] / 2.0 - (y + h / 2.0)) * feet_per_pixel * meters_per_foot
+    heading = math.radians(pose.get('position/heading', 0.0))
+    north = forward * math.cos(heading) - right * math.sin(heading)
+    east = forward * math.sin(heading) + right * math.cos(heading)
+    latitude += north / meters_per_degree
+    longitude += east / (meters_per_degree * math.cos(math.radians(latitude)))
+    return latitude, longitude
+
+
+class Target:
+
+    def __init__(self, target_id, latitude, longitude, timestamp, distance):
+        self.target_id = target_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distance = distance
+        self.hits = 1
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.reported_latitude = latitude
+        self.reported_longitude = longitude
+        self.reported_hits = 1
+        self.cell = None
+
+    def confidence(self):
+        return self.hits / (self.hits + 3.0)
+
+    def __str__(self):
+        return ("Target(id=" + str(self.target_id) + ",lat=" + str(self.latitude) + ",lon=" +
+                str(self.longitude) + ",hits=" + str(self.hits) + ")")
+
+
+class TargetStore:
+
+    # Confirmed targets in a grid of merge_radius sized cells over a local
+    # flat-earth projection. A detection is merged into the nearest target
+    # within merge_radius metres, found by looking at the 3x3 cells around
+    # it, so each lookup is O(1) however many targets are held.
+    #
+    # add() returns the target and 'new' when a target is created,
+    # 'update' when its mean position has moved more than update_distance
+    # metres or its hit count has doubled since it was last passed on, and
+    # None otherwise. Only 'new' and 'update' need to go downstream.
+
+    def __init__(self, merge_radius=10.0, update_distance=5.0):
+        self.merge_radius = merge_radius
+        self.update_distance = update_distance
+        self.lock = threading.Lock()
+        self.cells = {}
+        self.targets = {}
+        self.next_id = 0
+        self.origin_latitude = None
+        self.meters_per_longitude = meters_per_degree
+        self.detections = 0
+        self.events = 0
+
+    def local(self, latitude, longitude):
+        return latitude * meters_per_degree, longitude * self.meters_per_longitude
+
+    def cell_of(self, latitude, longitude):
+        (north, east) = self.local(latitude, longitude)
+        return (int(math.floor(north / self.merge_radius)), int(math.floor(east / self.merge_radius)))
+
+    def add(self, latitude, longitude, timestamp, distance=0.0):
+        with self.lock:
+            self.detections += 1
+            if self.origin_latitude is None:
+                self.origin_latitude = latitude
+                self.meters_per_longitude = meters_per_degree * math.cos(math.radians(latitude))
+
+            target = self.nearest(latitude, longitude)
+            if target is None:
+                target = Target(self.next_id, latitude, longitude, timestamp, distance)
+                self.next_id = (self.next_id + 1) % id_limit
+                self.targets[target.target_id] = target
+                self.place(target)
+                self.events += 1
+                return target, 'new'
+
+            target.hits += 1
+            target.latitude += (latitude - target.latitude) / target.hits
+            target.longitude += (longitude - target.longitude) / target.hits
+            target.distance += (distance - target.distance) / target.hits
+            target.last_seen = timestamp
+            self.place(target)
+
+            if (self.separation(target.latitude, target.longitude, target.reported_latitude,
+                                target.reported_longitude) > self.update_distance or
+                    target.hits >= 2 * target.reported_hits):
+                target.reported_latitude = target.latitude
+                target.reported_longitude = target.longitude
+                target.reported_hits = target.hits
+                self.events += 1
+                return target, 'update'
+            return target, None
+
+    def nearest(self, latitude, longitude):
+        (row, column) = self.cell_of(latitude, longitude)
+        best = None
+        best_distance = self.merge_radius
+        for d_row in (-1, 0, 1):
+            for d_column in (-1, 0, 1):
+                for target in self.cells.get((row + d_row, column + d_column), ()):
+                    distance = self.separation(latitude, longitude, target.latitude, target.longitude)
+                    if distance <= best_distance:
+                        best = target
+                        best_distance = distance
+        return best
+
+    def place(self, target):
+        cell = self.cell_of(target.latitude, target.longitude)
+        if cell == target.cell:
+            return
+        if target.cell is not None:
+            self.cells[target.cell].remove(target)
+            if not self.cells[target.cell]:
+                del self.cells[target.cell]
+        self.cells.setdefault(cell, []).append(target)
+        target.cell = cell
+
+    def separation(self, latitude_a, longitude_a, latitude_b, longitude_b):
+        (north_a, east_a) = self.local(latitude_a, longitude_a)
+        (north_b, east_b) = self.local(latitude_b, longitude_b)
+        return math.hypot(north_a - north_b, east_a - east_b)
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __str__(self):
+        return ("TargetStore(targets=" + str(len(self.targets)) + ",detections=" + str(self.detections) +
+                ",events=" + str(self.events) + ")")
@@ -0,0 +1,126 @@
+import time
+from array import array
+
+
+class Ring:
+
+    # Fixed-size ring of timestamped samples kept in flat arrays, one per
+    # field. There is a single writer (the FC link). Readers never lock:
+    # sample k lives in slot k % size, and a lookup is retried if the writer
+    # lapped the slots it used while it was reading. The oldest guard slots
+    # are never read, so a few writes during a lookup do not force a retry.
+
+    guard = 16
+
+    def __init__(self, fields, size=1024, periods=None):
+        self.fields = tuple(fields)
+        self.size = max(size, 2 * Ring.guard)
+        self.periods = tuple(periods) if periods is not None else (None,) * len(self.fields)
+        self.times = array('d', bytes(8 * self.size))
+        self.columns = [array('d', bytes(8 * self.size)) for _ in self.fields]
+        self.written = 0
+
+    def append(self, timestamp, values):
+        slot = self.written % self.size
+        self.times[slot] = timestamp
+        for column, value in zip(self.columns, values):
+            column[slot] = value
+        # Publish only after the slot is complete
+        self.written += 1
+
+    def latest(self):
+        written = self.written
+        if not written:
+            return None
+        slot = (written - 1) % self.size
+        return self.times[slot], [column[slot] for column in self.columns]
+
+    def sample(self, timestamp):
+        # Field values linearly interpolated at timestamp, clamped to the
+        # oldest and newest sample. Angles with a period take the short way
+        # round. Returns None while the ring is empty.
+        while True:
+            written = self.written
+            if not written:
+                return None
+            first = max(0, written - self.size + Ring.guard)
+            result = self.interpolate(timestamp, first, written - 1)
+            if self.written - self.size < first:
+                return result
+
+    def interpolate(self, timestamp, first, last):
+        size = self.size
+        times = self.times
+        # Last sample taken at or before timestamp (bisect_right - 1)
+        lo, hi = first, last + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if timestamp < times[mid % size]:
+                hi = mid
+            else:
+                lo = mid + 1
+        before = lo - 1
+        if before < first:
+            slot = first % size
+            return dict(zip(self.fields, [column[slot] for column in self.columns]))
+        if before >= last:
+            slot = last % size
+            return dict(zip(self.fields, [column[slot] for column in self.columns]))
+
+        slot_a = before % size
+        slot_b = (before + 1) % size
+        span = times[slot_b] - times[slot_a]
+        fraction = (timestamp - times[slot_a]) / span if span > 0 else 0.0
+        output = {}
+        for name, column, period in zip(self.fields, self.columns, self.periods):
+            a = column[slot_a]
+            delta = column[slot_b] - a
+            if period is not None:
+                delta = (delta + period / 2) % period - period / 2
+                value = a + delta * fraction
+                output[name] = (value + period / 2) % period - period / 2
+            else:
+                output[name] = a + delta * fraction
+        return output
+
+
+class TelemetryBuffer:
+
+    # Aircraft pose history from the Position Report (1) and Attitude
+    # Report (2), so a camera frame can be tagged with the pose at its
+    # capture time instead of whatever arrived last
+
+    position_fields = ('position/longitude', 'position/latitude', 'position/altitude', 'position/heading')
+    attitude_fields = ('position/roll', 'position/pitch', 'position/yaw')
+
+    def __init__(self, size=1024):
+        self.position = Ring(TelemetryBuffer.position_fields, size, (None, None, None, 360.0))
+        self.attitude = Ring(TelemetryBuffer.attitude_fields, size, (360.0, None, 360.0))
+
+    def subscribe(self, parser):
+        parser.subscribe(parser.get_message_id('Position Report'), self.handle_position,
+                         TelemetryBuffer.position_fields)
+        parser.subscribe(parser.get_message_id('Attitude Report'), self.handle_attitude,
+                         TelemetryBuffer.attitude_fields)
+
+    def handle_position(self, packet, message):
+        if message:
+            self.position.append(time.time(), [message[name] for name in TelemetryBuffer.position_fields])
+
+    def handle_attitude(self, packet, message):
+        if message:
+            self.attitude.append(time.time(), [message[name] for name in TelemetryBuffer.attitude_fields])
+
+    def pose(self, timestamp):
+        # Interpolated position and attitude at timestamp; fields whose
+        # report has not arrived yet are missing
+        output = {}
+        for ring in (self.position, self.attitude):
+            sample = ring.sample(timestamp)
+            if sample is not None:
+                output.update(sample)
+        return output
+
+    def latest_time(self):
+        latest = self.position.latest()
+        return latest[0] if latest is not None else None
@@ -0,0 +1,303 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+import VACSColumns
+
+
+# Recorded flight data: <directory>/telemetry-<start ms>.vtr files, each a
+# file header followed by compressed chunks.
+#
+#   file header:  'VTRF', version, JSON length, then JSON with the schema
+#                 hash and the dtype of every recorded message
+#   chunk:        chunk_struct header, then zlib(times as float64 followed
+#                 by the rows' payload bytes)
+#
+# Chunk headers carry the message id and first and last time, so a reader
+# skips chunks outside a time range without decompressing them.
+
+file_struct = struct.Struct('<4sHI')
+chunk_struct = struct.Struct('<4sHIddII')
+file_magic = b'VTRF'
+chunk_magic = b'VTRC'
+version = 1
+
+
+def dtype_to_json(dtype):
+    return {
+        'names': list(dtype.names),
+        'formats': [dtype.fields[name][0].str for name in dtype.names],
+        'offsets': [dtype.fields[name][1] for name in dtype.names],
+        'itemsize': dtype.itemsize,
+    }
+
+
+class Column:
+
+    # Rows of one message: a preallocated float64 time column and the raw
+    # payloads back to back, i.e. a VACSColumns.message_dtype array
+
+    def __init__(self, message_def, rows):
+        self.message_id = message_def.message_id
+        self.row_size = message_def.length
+        self.times = np.empty(rows, dtype=np.float64)
+        self.data = bytearray(rows * self.row_size)
+        self.rows = 0
+
+
+class Recorder:
+
+    # Records every fixed-layout message of a live link. The parser
+    # callback only copies the payload into the message's column buffer;
+    # packets are subscribed with no fields, so the parser never decodes
+    # them. A full buffer is swapped for an empty one and handed to the
+    # writer thread, which compresses it and rotates files by size and age.
+    # If the writer falls behind by queue_size chunks, chunks are dropped
+    # and counted rather than blocking the receive loop. Partly filled
+    # buffers are flushed every flush_seconds. A chunk that cannot be
+    # written is counted in write_errors and its rows in dropped_rows, and
+    # the next chunk starts a fresh file.
+
+    def __init__(self, parser, directory, message_ids=None, chunk_rows=1024,
+                 rotate_bytes=16 * 1024 ** 2, rotate_seconds=600, flush_seconds=5.0,
+                 queue_size=64, level=6):
+        self.parser = parser
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.flush_seconds = flush_seconds
+        self.level = level
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(queue_size)
+        self.columns = {}
+        self.definitions = {}
+        self.rows = 0
+        self.rejected = 0
+        self.dropped_rows = 0
+        self.write_errors = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.files_written = 0
+        self.file = None
+        self.file_bytes = 0
+        self.file_start = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+        decoder = parser.decoder
+        if message_ids is None:
+            message_ids = sorted(decoder.messages)
+        for message_id in message_ids:
+            message_def = decoder.messages[message_id]
+            if message_def.sequence is not None or message_id == 125 or not message_def.length:
+                continue
+            self.definitions[message_id] = message_def
+            self.columns[message_id] = Column(message_def, chunk_rows)
+            parser.subscribe(message_id, self.handle, ())
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='recorder', daemon=True)
+        self.thread.start()
+
+    def handle(self, packet, message):
+        column = self.columns[packet.message_id]
+        if len(packet.data) != column.row_size:
+            self.rejected += 1
+            return
+        with self.lock:
+            row = column.rows
+            column.times[row] = time.time()
+            column.data[row * column.row_size:(row + 1) * column.row_size] = packet.data
+            column.rows = row + 1
+            self.rows += 1
+            if column.rows == self.chunk_rows:
+                self.swap(column)
+
+    def swap(self, column):
+        # Called with the lock held
+        self.columns[column.message_id] = Column(self.definitions[column.message_id], self.chunk_rows)
+        try:
+            self.queue.put_nowait(column)
+        except queue.Full:
+            self.dropped_rows += column.rows
+
+    def flush(self):
+        with self.lock:
+            for column in list(self.columns.values()):
+                if column.rows:
+                    self.swap(column)
+
+    def run(self):
+        next_flush = time.time() + self.flush_seconds
+        while True:
+            try:
+                column = self.queue.get(timeout=max(0.0, next_flush - time.time()))
+            except queue.Empty:
+                column = False
+            if column is None:
+                break
+            if column:
+                try:
+                    self.write(column)
+                except OSError as error:
+                    with self.lock:
+                        self.write_errors += 1
+                        self.dropped_rows += column.rows
+                    print("Recorder: write failed:", error)
+                    self.close_file()
+            if time.time() >= next_flush:
+                next_flush += self.flush_seconds
+                if self.running:
+                    self.flush()
+        self.close_file()
+
+    def close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+    def open_file(self, now):
+        self.close_file()
+        path = os.path.join(self.directory, 'telemetry-' + str(int(now * 1000)) + '.vtr')
+        schema = {
+            'schema_hash': self.parser.decoder.schema_hash,
+            'messages': {str(message_id): {'name': message_def.name,
+                                           'dtype': dtype_to_json(VACSColumns.message_dtype(message_def))}
+                         for message_id, message_def in self.definitions.items()},
+        }
+        header = json.dumps(schema).encode('utf-8')
+        self.file = open(path, 'wb')
+        self.file.write(file_struct.pack(file_magic, version, len(header)) + header)
+        self.file_bytes = file_struct.size + len(header)
+        self.file_start = now
+        self.files_written += 1
+
+    def write(self, column):
+        now = time.time()
+        if (self.file is None or self.file_bytes >= self.rotate_bytes or
+                now - self.file_start >= self.rotate_seconds):
+            self.open_file(now)
+        rows = column.rows
+        raw = column.times[:rows].tobytes() + bytes(memoryview(column.data)[:rows * column.row_size])
+        body = zlib.compress(raw, self.level)
+        self.file.write(chunk_struct.pack(chunk_magic, column.message_id, rows,
+                                          column.times[0], column.times[rows - 1], len(raw), len(body)))
+        self.file.write(body)
+        self.file.flush()
+        self.file_bytes += chunk_struct.size + len(body)
+        self.chunks_written += 1
+        self.bytes_written += chunk_struct.size + len(body)
+
+    def close(self):
+        for message_id in self.definitions:
+            self.parser.unsubscribe(message_id, self.handle)
+        self.running = False
+        self.flush()
+        # Only wait for queue space while the writer is alive to drain it
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+
+    def __str__(self):
+        return ("Recorder(rows=" + str(self.rows) + ",chunks=" + str(self.chunks_written) +
+                ",files=" + str(self.files_written) + ",bytes=" + str(self.bytes_written) +
+                ",dropped_rows=" + str(self.dropped_rows) + ",write_errors=" + str(self.write_errors) +
+                ",rejected=" + str(self.rejected) + ")")
+
+
+class Reader:
+
+    # Opens a recording directory by reading only the file and chunk
+    # headers; read() decompresses just the chunks of one message that
+    # overlap the requested time range
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.dtypes = {}
+        self.names = {}
+        self.chunks = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.vtr'):
+                self.index(os.path.join(directory, name))
+
+    def index(self, path):
+        with open(path, 'rb') as record_file:
+            header = record_file.read(file_struct.size)
+            if len(header) < file_struct.size:
+                return
+            magic, file_version, length = file_struct.unpack(header)
+            if magic != file_magic or file_version != version:
+                return
+            schema = json.loads(record_file.read(length).decode('utf-8'))
+            for message_id, message in schema['messages'].items():
+                self.dtypes[int(message_id)] = np.dtype(message['dtype'])
+                self.names[int(message_id)] = message['name']
+            offset = file_struct.size + length
+            while True:
+                record_file.seek(offset)
+                header = record_file.read(chunk_struct.size)
+                if len(header) < chunk_struct.size:
+                    break
+                magic, message_id, rows, first, last, raw_size, size = chunk_struct.unpack(header)
+                if magic != chunk_magic:
+                    break
+                offset += chunk_struct.size
+                # A chunk cut short by a crash ends the file
+                if offset + size > os.path.getsize(path):
+                    break
+                self.chunks.append((first, last, message_id, rows, path, offset, size))
+                offset += size
+
+    def message_ids(self):
+        return sorted(set(chunk[2] for chunk in self.chunks))
+
+    def time_range(self):
+        if not self.chunks:
+            return None
+        return min(chunk[0] for chunk in self.chunks), max(chunk[1] for chunk in self.chunks)
+
+    def read(self, message_id, start=None, stop=None):
+        # Rows of message_id with start <= time < stop, in time order, as a
+        # structured array with a 'time' field ahead of the message's fields
+        source = self.dtypes[message_id]
+        dtype = np.dtype({
+            'names': ['time'] + list(source.names),
+            'formats': ['<f8'] + [source.fields[name][0] for name in source.names],
+            'offsets': [0] + [source.fields[name][1] + 8 for name in source.names],
+            'itemsize': source.itemsize + 8,
+        })
+        parts = []
+        for first, last, chunk_id, rows, path, offset, size in self.chunks:
+            if chunk_id != message_id:
+                continue
+            if (start is not None and last < start) or (stop is not None and first >= stop):
+                continue
+            with open(path, 'rb') as record_file:
+                record_file.seek(offset)
+                raw = zlib.decompress(record_file.read(size))
+            part = np.zeros(rows, dtype=dtype)
+            part['time'] = np.frombuffer(raw, dtype='<f8', count=rows)
+            records = np.frombuffer(raw, dtype=source, count=rows, offset=rows * 8)
+            for name in source.names:
+                part[name] = records[name]
+            keep = np.ones(rows, dtype=bool)
+            if start is not None:
+                keep &= part['time'] >= start
+            if stop is not None:
+                keep &= part['time'] < stop
+            parts.append(part[keep])
+        if not parts:
+            return np.zeros(0, dtype=dtype)
+        output = np.concatenate(parts)
+        return output[np.argsort(output['time'], kind='stable')]
@@ -0,0 +1,238 @@
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import numpy as np
+import VACSColumns
+import VACSMessages
+import VACSParser
+
+
+# Multi-process framing and decoding of recorded logs.
+#
+# A log is cut into chunks of about chunk_size bytes, each starting at a
+# verified packet (sync word, header and checksum). Workers collect the
+# checksum-valid packet candidates whose sync word lies in their chunk,
+# reading up to one maximum packet past its end to finish packets that
+# straddle the edge. Candidate validity only depends on the packet's own
+# bytes, so concatenating the chunks' candidates and dropping overlaps once
+# gives exactly VACSColumns.frame() of the whole file. The accepted packets
+# are then decoded per chunk in the pool and merged in file order.
+#
+# Workers open the logs themselves (memory mapped), so only offsets and
+# results cross process boundaries.
+
+max_packet = 10 + VACSColumns.payload_size_max
+worker_decoder = None
+
+
+def init_worker(message_definition_path):
+    global worker_decoder
+    worker_decoder = VACSMessages.Decoder.load(message_definition_path)
+
+
+def map_log(path):
+    with open(path, 'rb') as log_file:
+        if os.fstat(log_file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def split(path, chunk_size):
+    # Chunk start offsets: every chunk_size bytes, moved forward to the next
+    # verified packet start when there is one within a chunk. Only a few
+    # packets' worth of bytes after each nominal offset are searched, and
+    # the search widens only while nothing is found, so this stays cheap
+    # next to the framing done in the pool.
+    data = map_log(path)
+    size = len(data)
+    boundaries = [0]
+    nominal = chunk_size
+    while nominal < size:
+        boundary = nominal
+        span = 2 * max_packet
+        while True:
+            span = min(span, chunk_size)
+            stop = min(size, nominal + span + max_packet)
+            found = VACSColumns.candidates(data[nominal:stop], span)
+            if len(found):
+                boundary = nominal + int(found['offset'][0])
+                break
+            if span >= chunk_size or stop >= size:
+                break
+            span *= 2
+        if boundary >= size:
+            break
+        boundaries.append(boundary)
+        nominal = boundary + chunk_size
+    boundaries.append(size)
+    if isinstance(data, mmap.mmap):
+        data.close()
+    return boundaries
+
+
+def frame_range(path, start, stop):
+    # Candidates with their sync word in [start, stop), file offsets
+    data = map_log(path)
+    window = data[start:min(len(data), stop + max_packet)]
+    if isinstance(data, mmap.mmap):
+        data.close()
+    packets = VACSColumns.candidates(window, stop - start)
+    packets['offset'] += start
+    return packets
+
+
+def window_of(path, packets):
+    # The bytes spanned by packets, and packets rebased onto them
+    data = map_log(path)
+    start = int(packets['offset'][0])
+    stop = int(packets['offset'][-1]) + 10 + int(packets['length'][-1])
+    window = data[start:stop]
+    if isinstance(data, mmap.mmap):
+        data.close()
+    packets = packets.copy()
+    packets['offset'] -= start
+    return window, packets
+
+
+def decode_range(path, packets):
+    # Per-message structured arrays for packets of one chunk
+    if not len(packets):
+        return {}
+    window, packets = window_of(path, packets)
+    return VACSColumns.decode(worker_decoder, window, packets)
+
+
+def records_range(path, packets):
+    # One JSON line per packet, decoded like Decoder.decode (sequences
+    # included), with the packet's file offset
+    if not len(packets):
+        return []
+    base = int(packets['offset'][0])
+    window, packets = window_of(path, packets)
+    view = memoryview(window)
+    lines = []
+    for record in packets:
+        offset = int(record['offset'])
+        packet = VACSParser.Parser.Packet(
+            int(record['src_addr']), int(record['dst_addr']), int(record['message_id']),
+            view[offset + 8:offset + 8 + int(record['length'])], worker_decoder)
+        lines.append(json.dumps({
+            'offset': base + offset,
+            'src_addr': packet.src_addr,
+            'dst_addr': packet.dst_addr,
+            'message_id': packet.message_id,
+            'message': packet.message,
+        }))
+    view.release()
+    return lines
+
+
+class BatchDecoder:
+
+    def __init__(self, message_definition_path, processes=None, chunk_size=1 << 20):
+        self.message_definition_path = message_definition_path
+        self.chunk_size = chunk_size
+        self.pool = multiprocessing.Pool(processes, init_worker, (message_definition_path,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def chunks(self, paths):
+        # (path, start, stop) for every chunk of every file, files in order
+        splits = self.pool.starmap(split, [(path, self.chunk_size) for path in paths])
+        return [(path, boundaries[k], boundaries[k + 1])
+                for path, boundaries in zip(paths, splits) for k in range(len(boundaries) - 1)]
+
+    def frame(self, paths):
+        # {path: packet_dtype array}, identical to VACSColumns.frame per file,
+        # plus the chunk list used
+        chunks = self.chunks(paths)
+        found = self.pool.starmap(frame_range, chunks)
+        output = {}
+        for path in paths:
+            parts = [packets for chunk, packets in zip(chunks, found) if chunk[0] == path]
+            if parts:
+                output[path] = VACSColumns.drop_overlaps(np.concatenate(parts))
+            else:
+                output[path] = np.zeros(0, dtype=VACSColumns.packet_dtype)
+        return output, chunks
+
+    def per_chunk(self, framed, chunks):
+        # Accepted packets of each chunk, in chunk order
+        tasks = []
+        for path, start, stop in chunks:
+            packets = framed[path]
+            first, last = np.searchsorted(packets['offset'], [start, stop], 'left')
+            tasks.append((path, packets[first:last]))
+        return tasks
+
+    def decode(self, paths):
+        # {path: {message_id: structured array}} for fixed-layout messages
+        framed, chunks = self.frame(paths)
+        tasks = self.per_chunk(framed, chunks)
+        results = self.pool.starmap(decode_range, tasks)
+        output = {path: {} for path in paths}
+        for (path, packets), arrays in zip(tasks, results):
+            for message_id, array in arrays.items():
+                output[path].setdefault(message_id, []).append(array)
+        for path in paths:
+            output[path] = {message_id: np.concatenate(parts)
+                            for message_id, parts in sorted(output[path].items())}
+        return output, framed
+
+    def records(self, paths, write):
+        # write(path, lines) for every chunk in file order; chunks are
+        # decoded ahead in the pool while earlier ones are written
+        framed, chunks = self.frame(paths)
+        tasks = self.per_chunk(framed, chunks)
+        for (path, packets), lines in zip(tasks, self.pool.imap(
+                records_task, tasks, chunksize=1)):
+            write(path, lines)
+        return framed
+
+
+def records_task(task):
+    return records_range(*task)
+
+
+def main(argv):
+    arguments = argparse.ArgumentParser(description="Frame and decode VACS logs on all cores")
+    arguments.add_argument('logs', nargs='+')
+    arguments.add_argument('--definition', default='FCSPlaneDefinition_Aries_FCS.xml')
+    arguments.add_argument('--format', choices=('npz', 'jsonl'), default='npz',
+                           help="per-message arrays (<log>.npz) or records (<log>.jsonl)")
+    arguments.add_argument('--processes', type=int)
+    arguments.add_argument('--chunk-size', type=int, default=1 << 20)
+    options = arguments.parse_args(argv)
+
+    with BatchDecoder(options.definition, options.processes, options.chunk_size) as batch:
+        if options.format == 'npz':
+            decoded, framed = batch.decode(options.logs)
+            for path in options.logs:
+                arrays = {'m' + str(message_id): array for message_id, array in decoded[path].items()}
+                np.savez(path + '.npz', packets=framed[path], **arrays)
+                print(path, len(framed[path]), "packets,", len(arrays), "messages ->", path + '.npz')
+        else:
+            outputs = {path: open(path + '.jsonl', 'w') for path in options.logs}
+
+            def write(path, lines):
+                if lines:
+                    outputs[path].write('\n'.join(lines) + '\n')
+            framed = batch.records(options.logs, write)
+            for path in options.logs:
+                outputs[path].close()
+                print(path, len(framed[path]), "packets ->", path + '.jsonl')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
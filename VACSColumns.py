@@ -0,0 +1,163 @@
+import numpy as np
+import VACSMessages
+
+
+packet_dtype = np.dtype([
+    ('offset', '<i8'),
+    ('dst_addr', 'u1'),
+    ('src_addr', 'u1'),
+    ('message_id', '<u2'),
+    ('length', '<u2'),
+])
+
+expected_sync_0 = 0x76
+expected_sync_1 = 0x63
+payload_size_max = 1024
+
+
+def fields_dtype(fields_def):
+    # Packed structured dtype matching fields_def.struct. A property that
+    # appears more than once keeps its last position, like Decoder.decode.
+    byte_order = fields_def.struct.format[0]
+    fields = {}
+    offset = 0
+    for name, field_type in zip(fields_def.field_names, fields_def.field_types):
+        field_format = byte_order + VACSMessages.Decoder.type_formats[field_type]
+        fields[name] = (field_format, offset)
+        offset += np.dtype(field_format).itemsize
+    return np.dtype({
+        'names': list(fields),
+        'formats': [fields[name][0] for name in fields],
+        'offsets': [fields[name][1] for name in fields],
+        'itemsize': fields_def.struct.size,
+    })
+
+
+def message_dtype(message_def):
+    return fields_dtype(message_def)
+
+
+def sequence_dtype(message_def):
+    return fields_dtype(message_def.sequence)
+
+
+def decode_sequence(message_def, packet):
+    # Zero-copy structured view of the repeated blocks of one packet, or
+    # None if the payload does not match the definition
+    sequence = message_def.sequence
+    header_length = message_def.length + sequence.count_struct.size
+    if len(packet.data) < header_length:
+        return None
+    count = sequence.count_struct.unpack_from(packet.data, message_def.length)[0]
+    if header_length + count * sequence.struct.size != len(packet.data):
+        return None
+    return np.frombuffer(packet.data, dtype=sequence_dtype(message_def),
+                         count=count, offset=header_length)
+
+
+def frame(buffer):
+    # Locate every valid packet in buffer and return them as a packet_dtype
+    # array in stream order
+    return drop_overlaps(candidates(buffer))
+
+
+def candidates(buffer, limit=None):
+    # Every checksum-valid packet whose sync word starts before limit (the
+    # whole buffer by default); bytes past limit are only read to finish
+    # those packets. Candidates may overlap. Checksums of all sync
+    # candidates are checked at once, see checksums().
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = len(data)
+    if size < 10:
+        return np.zeros(0, dtype=packet_dtype)
+
+    starts = np.flatnonzero((data[:-9] == expected_sync_0) &
+                            (data[1:-8] == expected_sync_1))
+    if limit is not None:
+        starts = starts[starts < limit]
+    lengths = data[starts + 6].astype(np.int64) | (data[starts + 7].astype(np.int64) << 8)
+    ends = starts + 8 + lengths
+    fits = (lengths <= payload_size_max) & (ends + 2 <= size)
+    starts, lengths, ends = starts[fits], lengths[fits], ends[fits]
+
+    chk_a, chk_b = checksums(data, starts + 2, ends)
+    valid = (chk_a == data[ends]) & (chk_b == data[ends + 1])
+    starts, lengths = starts[valid], lengths[valid]
+
+    packets = np.zeros(len(starts), dtype=packet_dtype)
+    packets['offset'] = starts
+    packets['dst_addr'] = data[starts + 2]
+    packets['src_addr'] = data[starts + 3]
+    packets['message_id'] = data[starts + 4].astype(np.uint16) | (data[starts + 5].astype(np.uint16) << 8)
+    packets['length'] = lengths
+    return packets
+
+
+def checksums(data, first, ends):
+    # Parser.compute_checksum of data[first[k]:ends[k]] for every k at once,
+    # from running sums of data. They are only needed modulo 256, so uint64
+    # wrap-around is harmless.
+    size = len(data)
+    sums = np.zeros(size + 1, dtype=np.uint64)
+    np.cumsum(data, dtype=np.uint64, out=sums[1:])
+    sums_of_sums = np.zeros(size + 2, dtype=np.uint64)
+    np.cumsum(sums, dtype=np.uint64, out=sums_of_sums[1:])
+    chk_a = (sums[ends] - sums[first]) % 256
+    chk_b = (sums_of_sums[ends + 1] - sums_of_sums[first + 1] -
+             (ends - first).astype(np.uint64) * sums[first]) % 256
+    return chk_a.astype(np.uint8), chk_b.astype(np.uint8)
+
+
+def drop_overlaps(packets):
+    # A candidate inside the payload of an accepted packet is not a packet
+    starts = packets['offset']
+    ends = starts + 10 + packets['length'].astype(np.int64)
+    if len(starts) < 2 or not np.any(starts[1:] < ends[:-1]):
+        return packets
+    keep = np.ones(len(starts), dtype=bool)
+    cursor = 0
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        if start < cursor:
+            keep[i] = False
+        else:
+            cursor = end
+    return packets[keep]
+
+
+def decode(decoder, buffer, packets=None):
+    # Decode every fixed-layout message in buffer into one structured array
+    # per message_id. Packets whose length does not match the definition are
+    # skipped, as Decoder.decode does. Messages with a sequence are left to
+    # decode_sequence.
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if packets is None:
+        packets = frame(buffer)
+
+    output = {}
+    for message_id in np.unique(packets['message_id']).tolist():
+        message_def = decoder.messages.get(message_id)
+        if message_def is None or message_def.sequence is not None:
+            continue
+        group = packets[(packets['message_id'] == message_id) &
+                        (packets['length'] == message_def.length)]
+        dtype = message_dtype(message_def)
+        if not len(group) or not message_def.length:
+            output[message_id] = np.zeros(len(group), dtype=dtype)
+            continue
+        # Overlapping length-byte windows over the buffer, one per byte, so
+        # selecting rows copies only the payloads
+        windows = np.lib.stride_tricks.as_strided(
+            data, shape=(len(data) - message_def.length + 1, message_def.length),
+            strides=(1, 1), writeable=False)
+        output[message_id] = np.frombuffer(
+            np.ascontiguousarray(windows[group['offset'] + 8]), dtype=dtype)
+    return output
+
+
+def decode_file(decoder, path):
+    with open(path, 'rb') as log:
+        return decode(decoder, log.read())
+
+
+def columns(array):
+    return {name: array[name] for name in array.dtype.names}
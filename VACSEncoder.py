@@ -0,0 +1,72 @@
+import struct
+import numpy as np
+import VACSColumns
+
+
+class Encoder:
+
+    # Packs many packets back to back into one write-ready buffer, byte for
+    # byte what Parser.create_message_packet produces for each of them.
+    #
+    # Fixed-layout messages are packed in place with pack_into behind a
+    # cached 8-byte header per (message_id, src_addr, dst_addr); the Message
+    # Report and sequence messages, whose length depends on the data, go
+    # through Decoder.createMessagePayload. The checksums of the whole batch
+    # are computed in one numpy pass once everything is packed.
+
+    header_struct = struct.Struct('<BBBBHH')
+
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.headers = {}
+
+    def header(self, message_id, length, src_addr, dst_addr):
+        key = (message_id, src_addr, dst_addr)
+        header = self.headers.get(key)
+        if header is None:
+            header = Encoder.header_struct.pack(VACSColumns.expected_sync_0, VACSColumns.expected_sync_1,
+                                                dst_addr, src_addr, message_id, length)
+            self.headers[key] = header
+        return header
+
+    def encode(self, packets):
+        # packets: iterable of (message_id, message_data, src_addr, dst_addr)
+        layout = []
+        total = 0
+        for message_id, message_data, src_addr, dst_addr in packets:
+            message_def = self.decoder.messages[message_id]
+            if message_id == 125 or message_def.sequence is not None:
+                payload = self.decoder.createMessagePayload(message_id, message_data)
+                header = Encoder.header_struct.pack(VACSColumns.expected_sync_0, VACSColumns.expected_sync_1,
+                                                    dst_addr, src_addr, message_id, len(payload))
+                layout.append((total, header, payload, None, None))
+                total += len(payload) + 10
+            else:
+                header = self.header(message_id, message_def.length, src_addr, dst_addr)
+                layout.append((total, header, None, message_def, message_data))
+                total += message_def.length + 10
+
+        output = bytearray(total)
+        starts = []
+        ends = []
+        for offset, header, payload, message_def, message_data in layout:
+            output[offset:offset + 8] = header
+            if payload is None:
+                message_def.struct.pack_into(
+                    output, offset + 8, *[message_data[name] for name in message_def.field_names])
+                end = offset + 8 + message_def.length
+            else:
+                end = offset + 8 + len(payload)
+                output[offset + 8:end] = payload
+            starts.append(offset + 2)
+            ends.append(end)
+
+        if layout:
+            data = np.frombuffer(output, dtype=np.uint8)
+            ends = np.array(ends, dtype=np.int64)
+            chk_a, chk_b = VACSColumns.checksums(data, np.array(starts, dtype=np.int64), ends)
+            data[ends] = chk_a
+            data[ends + 1] = chk_b
+            # Release the export so the caller may resize output
+            del data
+        return output
@@ -0,0 +1,141 @@
+import mmap
+import os
+import struct
+import numpy as np
+import VACSColumns
+import VACSParser
+
+
+class LogIndex:
+
+    # Sidecar layout: header, then one VACSColumns.packet_dtype record per
+    # valid packet in stream order
+    header_struct = struct.Struct('<4sHxxqq')
+    magic = b'VIDX'
+    version = 1
+    # Bytes framed per pass when building the index; peak memory is a small
+    # multiple of this rather than of the log size
+    window_size = 1 << 20
+    max_packet = 10 + VACSColumns.payload_size_max
+
+    def __init__(self, log_path, index_path=None, decoder=None):
+        self.log_path = log_path
+        self.decoder = decoder
+        self.index_path = index_path if index_path is not None else log_path + '.idx'
+        self.log_file = open(log_path, 'rb')
+        stat = os.fstat(self.log_file.fileno())
+        self.log_size = stat.st_size
+        self.log_mtime = stat.st_mtime_ns
+        if self.log_size > 0:
+            self.map = mmap.mmap(self.log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = None
+        self.view = memoryview(self.map if self.map is not None else b'')
+
+        self.records = self.load()
+        if self.records is None:
+            self.records = self.frame()
+            self.save()
+        self.offsets = self.records['offset']
+        self.by_message_id = {}
+
+    def frame(self):
+        # VACSColumns.frame over the log, one window at a time. Each window
+        # reads up to max_packet bytes past its end to finish packets whose
+        # sync word lies inside it.
+        parts = []
+        for start in range(0, self.log_size, LogIndex.window_size):
+            stop = min(self.log_size, start + LogIndex.window_size)
+            window = self.view[start:min(self.log_size, stop + LogIndex.max_packet)]
+            packets = VACSColumns.candidates(window, stop - start)
+            window.release()
+            packets['offset'] += start
+            parts.append(packets)
+        if not parts:
+            return np.zeros(0, dtype=VACSColumns.packet_dtype)
+        return VACSColumns.drop_overlaps(np.concatenate(parts))
+
+    def load(self):
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                header = index_file.read(LogIndex.header_struct.size)
+                if len(header) != LogIndex.header_struct.size:
+                    return None
+                magic, version, log_size, log_mtime = LogIndex.header_struct.unpack(header)
+                if (magic != LogIndex.magic or version != LogIndex.version or
+                        log_size != self.log_size or log_mtime != self.log_mtime):
+                    return None
+                records = np.fromfile(index_file, dtype=VACSColumns.packet_dtype)
+        except (OSError, ValueError):
+            return None
+        return records
+
+    def save(self):
+        temp_path = self.index_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as index_file:
+                index_file.write(LogIndex.header_struct.pack(
+                    LogIndex.magic, LogIndex.version, self.log_size, self.log_mtime))
+                index_file.write(self.records.tobytes())
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # A read-only log directory still gets an in-memory index
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Packets handed out keep views into the map. While any of them is
+        # alive the map cannot be closed; it is then left to be unmapped
+        # when the last of those views is collected.
+        try:
+            if self.view is not None:
+                self.view.release()
+            if self.map is not None:
+                self.map.close()
+        except BufferError:
+            pass
+        self.view = None
+        self.map = None
+        self.log_file.close()
+
+    def message_ids(self):
+        return np.unique(self.records['message_id']).tolist()
+
+    def positions(self, message_id):
+        if message_id not in self.by_message_id:
+            self.by_message_id[message_id] = np.flatnonzero(
+                self.records['message_id'] == message_id)
+        return self.by_message_id[message_id]
+
+    def make_packet(self, record):
+        offset = int(record['offset']) + 8
+        return VACSParser.Parser.Packet(
+            int(record['src_addr']), int(record['dst_addr']), int(record['message_id']),
+            self.view[offset:offset + int(record['length'])], self.decoder)
+
+    def packet(self, k, message_id=None):
+        if message_id is None:
+            return self.make_packet(self.records[k])
+        return self.make_packet(self.records[self.positions(message_id)[k]])
+
+    def packets(self, message_id=None, start=None, stop=None):
+        # Packets whose sync word lies in [start, stop), optionally only
+        # those of one message id
+        first = 0 if start is None else np.searchsorted(self.offsets, start, 'left')
+        last = len(self.offsets) if stop is None else np.searchsorted(self.offsets, stop, 'left')
+        if message_id is None:
+            selected = range(first, last)
+        else:
+            positions = self.positions(message_id)
+            selected = positions[(positions >= first) & (positions < last)].tolist()
+        for position in selected:
+            yield self.make_packet(self.records[position])
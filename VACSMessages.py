@@ -1,76 +1,269 @@
 import xml.etree.ElementTree as ET
+import hashlib
+import json
+import os
 import struct
 
 
 class Message:
     message_id = 0
     name = ""
-    field_names = []
-    field_types = []
+    field_names = ()
+    field_types = ()
+    field_mins = ()
+    field_maxs = ()
+    field_enums = ()
     length = 0
+    struct = None
+    sequence = None
 
     def __str__(self):
         return str(self.message_id) + ":" + self.name + "(fields=" + ':'.join(self.field_names) + ",types=" + ':'.join(self.field_types) + ')'
 
 
+class Sequence:
+    name = ""
+    count_name = ""
+    count_struct = None
+    field_names = ()
+    field_types = ()
+    struct = None
+
+
 class Decoder:
 
     namespace = '{http://www.engineering.vcu.edu/uav/PlaneDefinition}'
 
-    def __init__(self, message_definition_path):
+    type_formats = {
+        'byte': 'B',
+        'sbyte': 'b',
+        'short': 'h',
+        'ushort': 'H',
+        'float': 'f',
+        'long': 'i',
+        'ulong': 'I',
+    }
+
+    # Bump whenever the layout produced by parse_schema changes
+    schema_version = 2
+
+    # Decoders shared by load(), keyed by definition path, size and mtime
+    shared = {}
+
+    def __init__(self, message_definition_path, cache_path=None):
 
         self.messages = {}
         self.message_ids = {}
 
-        tree = ET.parse(message_definition_path)
-        root = tree.getroot()
+        with open(message_definition_path, 'rb') as definition_file:
+            content = definition_file.read()
+        self.schema_hash = hashlib.sha256(content).hexdigest()
 
-        xml_messages = root.findall(Decoder.namespace + 'message')
+        if cache_path is None:
+            cache_path = message_definition_path + '.cache'
+        schema = self.load_schema_cache(cache_path) if cache_path else None
+        if schema is None:
+            schema = self.parse_schema(content)
+            if cache_path:
+                self.save_schema_cache(cache_path, schema)
 
-        for xml_message in xml_messages:
+        self.byte_order = schema['byte_order']
+        for message_schema in schema['messages']:
+            message = self.build_message(message_schema)
+            self.messages[message.message_id] = message
+            self.message_ids[message.name] = message.message_id
 
-            message = Message()
-            message.name = xml_message.find(Decoder.namespace + 'name').text
-            message.message_id = int(xml_message.find(
-                Decoder.namespace + 'code').text)
-            message.field_names = []
-            message.field_types = []
-            message.length = 0
+    @classmethod
+    def load(cls, message_definition_path):
+        # One Decoder per definition file per process. Decoders are never
+        # modified after construction, so parsers can share them freely.
+        stat = os.stat(message_definition_path)
+        key = (os.path.abspath(message_definition_path), stat.st_size, stat.st_mtime_ns)
+        if key not in cls.shared:
+            cls.shared[key] = cls(message_definition_path)
+        return cls.shared[key]
+
+    def parse_schema(self, content):
+        root = ET.fromstring(content)
+
+        endian = root.find(Decoder.namespace + 'endian')
+        if endian is not None and endian.text.strip() == 'big':
+            byte_order = '>'
+        else:
+            byte_order = '<'
+
+        messages = []
+        for xml_message in root.findall(Decoder.namespace + 'message'):
+            fields = []
             format = xml_message.find(Decoder.namespace + 'format')
             for field in format.findall(Decoder.namespace + 'field'):
-                field_name = field.find(Decoder.namespace + 'property').text
-                field_type = field.find(Decoder.namespace + 'type').text
-                message.field_names.append(field_name)
-                message.field_types.append(field_type)
-                message.length += self.field_size(field_type)
-            self.messages[message.message_id] = message
-            self.message_ids[message.name] = message.message_id
+                fields.append(self.parse_field(field))
+            sequence = format.find(Decoder.namespace + 'sequence')
+            if sequence is not None:
+                block = sequence.find(Decoder.namespace + 'block')
+                sequence = {
+                    'property': sequence.find(Decoder.namespace + 'property').text,
+                    'count': self.parse_field(sequence.find(Decoder.namespace + 'count')),
+                    'fields': [self.parse_field(field) for field in block.findall(Decoder.namespace + 'field')],
+                }
+            messages.append({
+                'code': int(xml_message.find(Decoder.namespace + 'code').text),
+                'name': xml_message.find(Decoder.namespace + 'name').text,
+                'fields': fields,
+                'sequence': sequence,
+            })
+
+        return {
+            'version': Decoder.schema_version,
+            'hash': self.schema_hash,
+            'byte_order': byte_order,
+            'messages': messages,
+        }
+
+    def parse_field(self, field):
+        limits = []
+        for tag in ('min', 'max'):
+            limit = field.find(Decoder.namespace + tag)
+            limits.append(float(limit.text) if limit is not None else None)
+        choices = None
+        enum = field.find(Decoder.namespace + 'enum')
+        if enum is not None:
+            choices = {}
+            for choice in enum.findall(Decoder.namespace + 'choice'):
+                choices[choice.get('n')] = choice.text
+        return {
+            'property': field.find(Decoder.namespace + 'property').text,
+            'type': field.find(Decoder.namespace + 'type').text,
+            'min': limits[0],
+            'max': limits[1],
+            'enum': choices,
+        }
+
+    def build_message(self, message_schema):
+        message = Message()
+        message.name = message_schema['name']
+        message.message_id = message_schema['code']
+        fields, message.struct = self.build_fields(message_schema['fields'])
+        message.field_names = tuple(field['property'] for field in fields)
+        message.field_types = tuple(field['type'] for field in fields)
+        message.field_mins = tuple(field['min'] for field in fields)
+        message.field_maxs = tuple(field['max'] for field in fields)
+        message.field_enums = tuple(
+            None if field['enum'] is None else {int(n): text for n, text in field['enum'].items()}
+            for field in fields)
+        message.length = message.struct.size
+        if message_schema['sequence'] is not None:
+            message.sequence = self.build_sequence(message_schema['sequence'])
+        return message
+
+    def build_fields(self, field_schemas):
+        fields = []
+        struct_format = self.byte_order
+        for field in field_schemas:
+            if field['type'] not in Decoder.type_formats:
+                print("Unknown type: ", field['type'])
+                continue
+            fields.append(field)
+            struct_format += Decoder.type_formats[field['type']]
+        return fields, struct.Struct(struct_format)
+
+    def build_sequence(self, sequence_schema):
+        # A sequence is laid out after the fixed fields as the count
+        # followed by count packed copies of the block. The <offset> tags in
+        # the definition are not consistent enough to rely on.
+        sequence = Sequence()
+        sequence.name = sequence_schema['property']
+        sequence.count_name = sequence_schema['count']['property']
+        sequence.count_struct = struct.Struct(
+            self.byte_order + Decoder.type_formats[sequence_schema['count']['type']])
+        fields, sequence.struct = self.build_fields(sequence_schema['fields'])
+        sequence.field_names = tuple(field['property'] for field in fields)
+        sequence.field_types = tuple(field['type'] for field in fields)
+        return sequence
+
+    def load_schema_cache(self, cache_path):
+        try:
+            with open(cache_path, 'r') as cache_file:
+                schema = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if schema.get('version') != Decoder.schema_version or schema.get('hash') != self.schema_hash:
+            return None
+        return schema
+
+    def save_schema_cache(self, cache_path, schema):
+        # Write to a temporary file first so a crash never leaves a torn cache
+        temp_path = cache_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(schema, cache_file, separators=(',', ':'))
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
 
     def getMessageID(self, message_name):
         return self.message_ids[message_name]
 
     def field_size(self, field_type):
-        if field_type == 'byte' or field_type == 'sbyte':
-            return 1
-        elif field_type == 'short' or field_type == 'ushort':
-            return 2
-        elif field_type == 'float' or field_type == 'long' or field_type == 'ulong':
-            return 4
+        if field_type in Decoder.type_formats:
+            return struct.calcsize(Decoder.type_formats[field_type])
         else:
             print("Unknown type: ", field_type)
 
-    def decode(self, packet):
-        if packet.message_id not in self.messages:
-            #print("Message received with unknown message_id: ", packet.message_id)
-            return {}
+    def select_fields(self, message_id, field_names):
+        # Message that unpacks only field_names and skips the other fields
+        # with pad bytes, for passing to decode(). Returns None for messages
+        # that have no fixed layout.
+        message_def = self.messages[message_id]
+        if message_def.sequence is not None or message_id == 125:
+            return None
+        subset = Message()
+        subset.message_id = message_def.message_id
+        subset.name = message_def.name
+        names = []
+        types = []
+        struct_format = self.byte_order
+        for field_name, field_type in zip(message_def.field_names, message_def.field_types):
+            if field_name in field_names:
+                names.append(field_name)
+                types.append(field_type)
+                struct_format += Decoder.type_formats[field_type]
+            else:
+                struct_format += str(self.field_size(field_type)) + 'x'
+        subset.field_names = tuple(names)
+        subset.field_types = tuple(types)
+        subset.struct = struct.Struct(struct_format)
+        subset.length = subset.struct.size
+        return subset
+
+    def decode(self, packet, message_def=None):
+        if message_def is None:
+            if packet.message_id not in self.messages:
+                #print("Message received with unknown message_id: ", packet.message_id)
+                return {}
+            message_def = self.messages[packet.message_id]
 
-        message_def = self.messages[packet.message_id]
         output = {}
-        offset = 0
 
         if packet.message_id == 125:  # Message Report
             output['fcs/msg_code'] = packet.data[0]
-            output['fcs/msg_text'] = packet.data[2:].decode("ascii")
+            output['fcs/msg_text'] = bytes(packet.data[2:]).decode("ascii")
+
+        elif message_def.sequence is not None:
+            sequence = message_def.sequence
+            header_length = message_def.length + sequence.count_struct.size
+            if len(packet.data) < header_length:
+                return {}
+            count = sequence.count_struct.unpack_from(packet.data, message_def.length)[0]
+            if header_length + count * sequence.struct.size != len(packet.data):
+                return {}
+
+            output = dict(zip(message_def.field_names,
+                              message_def.struct.unpack_from(packet.data)))
+            output[sequence.count_name] = count
+            output[sequence.name] = [
+                dict(zip(sequence.field_names, values))
+                for values in sequence.struct.iter_unpack(memoryview(packet.data)[header_length:])]
 
         else:
             if message_def.length != len(packet.data):
@@ -78,72 +271,45 @@ class Decoder:
                 #      "(expected", message_def.length, "got", len(packet.data), ")")
                 return {}
 
-            for i in range(0, len(message_def.field_names)):
-                if message_def.field_types[i] == 'byte':
-                    output[message_def.field_names[i]] = packet.data[offset]
-                    offset += 1
-                elif message_def.field_types[i] == 'sbyte':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'b', packet.data, offset)[0]
-                    offset += 1
-                elif message_def.field_types[i] == 'float':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'f', packet.data, offset)[0]
-                    offset += 4
-                elif message_def.field_types[i] == 'short':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'h', packet.data, offset)[0]
-                    offset += 2
-                elif message_def.field_types[i] == 'ushort':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'H', packet.data, offset)[0]
-                    offset += 2
-                elif message_def.field_types[i] == 'long':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'i', packet.data, offset)[0]
-                    offset += 4
-                elif message_def.field_types[i] == 'ulong':
-                    output[message_def.field_names[i]] = struct.unpack_from(
-                        'I', packet.data, offset)[0]
-                    offset += 4
-                else:
-                    print("Unknown type: ", message_def.field_types[i])
+            output = dict(zip(message_def.field_names,
+                              message_def.struct.unpack_from(packet.data)))
 
         return output
 
     def createMessagePayload(self, message_id, message_data):
         message_def = self.messages[message_id]
-        payload = bytearray()
 
         if message_id == 125:  # Message Report
+            payload = bytearray()
             payload.extend(struct.pack('B', message_data['fcs/msg_code']))
             payload.extend(struct.pack('B', len(message_data['fcs/msg_text'])))
             payload.extend(message_data['fcs/msg_text'].encode('ascii'))
 
+        elif message_def.sequence is not None:
+            sequence = message_def.sequence
+            blocks = message_data[sequence.name]
+            header_length = message_def.length + sequence.count_struct.size
+            payload = bytearray(header_length + len(blocks) * sequence.struct.size)
+            message_def.struct.pack_into(
+                payload, 0, *[message_data[name] for name in message_def.field_names])
+            sequence.count_struct.pack_into(payload, message_def.length, len(blocks))
+            if hasattr(blocks, 'tobytes'):
+                # Already packed, e.g. a VACSColumns.sequence_dtype array
+                if blocks.ndim != 1 or blocks.itemsize != sequence.struct.size:
+                    raise ValueError("blocks of " + sequence.name + " must be a 1-d array of " +
+                                     str(sequence.struct.size) + "-byte records")
+                payload[header_length:] = blocks.tobytes()
+            else:
+                offset = header_length
+                for block in blocks:
+                    if isinstance(block, dict):
+                        block = [block[name] for name in sequence.field_names]
+                    sequence.struct.pack_into(payload, offset, *block)
+                    offset += sequence.struct.size
+
         else:
-            for i in range(0, len(message_def.field_names)):
-                if message_def.field_types[i] == 'byte':
-                    payload.extend(struct.pack(
-                        'B', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'sbyte':
-                    payload.extend(struct.pack(
-                        'b', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'float':
-                    payload.extend(struct.pack(
-                        'f', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'short':
-                    payload.extend(struct.pack(
-                        'h', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'ushort':
-                    payload.extend(struct.pack(
-                        'H', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'long':
-                    payload.extend(struct.pack(
-                        'i', message_data[message_def.field_names[i]]))
-                elif message_def.field_types[i] == 'ulong':
-                    payload.extend(struct.pack(
-                        'I', message_data[message_def.field_names[i]]))
-                else:
-                    print("Unknown type: ", message_def.field_types[i])
+            payload = bytearray(message_def.length)
+            message_def.struct.pack_into(
+                payload, 0, *[message_data[name] for name in message_def.field_names])
 
         return payload
@@ -1,4 +1,6 @@
 from enum import Enum
+from itertools import accumulate
+from time import perf_counter
 import VACSMessages
 import struct
 
@@ -6,11 +8,34 @@ import struct
 class Parser:
 
     class Packet:
-        src_addr = 0
-        dst_addr = 0
-        message_id = 0
-        data = bytearray()
-        message = {}
+        # data is normally a memoryview into the buffer the packet was framed
+        # from; call detach() before keeping a packet whose buffer is reused
+        __slots__ = ('src_addr', 'dst_addr', 'message_id', 'data', 'decoder', 'decoded')
+
+        def __init__(self, src_addr=0, dst_addr=0, message_id=0, data=b'', decoder=None):
+            self.src_addr = src_addr
+            self.dst_addr = dst_addr
+            self.message_id = message_id
+            self.data = data
+            self.decoder = decoder
+            self.decoded = None
+
+        def detach(self):
+            packet = Parser.Packet(self.src_addr, self.dst_addr, self.message_id,
+                                   bytes(self.data), self.decoder)
+            packet.decoded = self.decoded
+            return packet
+
+        # Decoded on first access, so packets nobody looks at cost nothing
+        @property
+        def message(self):
+            if self.decoded is None:
+                self.decoded = self.decoder.decode(self) if self.decoder is not None else {}
+            return self.decoded
+
+        @message.setter
+        def message(self, message):
+            self.decoded = message
 
         def __str__(self):
             return "VACS.Parser.Packet(src=" + str(self.src_addr) + ",dst=" + str(self.dst_addr) + ",m_id=" + str(self.message_id) + ",data_len=" + str(len(self.data)) + ")"
@@ -40,10 +65,14 @@ class Parser:
         self.constraints_error_count = 0
         self.checksum_error_count = 0
         self.correct_message_count = 0
+        self.unhandled_packet_count = 0
         self.current_byte = 0
         self.packet_ready = False
         self.packet_finished = None
-        self.decoder = VACSMessages.Decoder(message_definition_path)
+        self.decoder = VACSMessages.Decoder.load(message_definition_path)
+        self.handlers = {}
+        # Metrics.ParserProbe when runtime metrics are on
+        self.probe = None
 
         self.switcher = {
             Parser.States.sync0: Parser.parse_sync0,
@@ -63,10 +92,58 @@ class Parser:
         self.expected_sync_0 = 0x76
         self.expected_sync_1 = 0x63
         self.payload_size_max = 1024
+        self.payload_buffer = bytearray(self.payload_size_max)
+
+        # feed() state: unconsumed tail of the last chunk and whether the
+        # next byte must be sync0 (i.e. the previous packet was valid)
+        self.feed_pending = b''
+        self.feed_synced = False
+        self.header_struct = struct.Struct('<BBHH')
 
     def get_message_id(self, message_name):
         return self.decoder.getMessageID(message_name)
 
+    def subscribe(self, message_id, callback, fields=None):
+        # callback(packet, message) runs for every valid packet of
+        # message_id. With fields, message holds only those fields and the
+        # rest of the payload is never unpacked.
+        subset = None
+        if fields is not None:
+            subset = self.decoder.select_fields(message_id, fields)
+        self.handlers.setdefault(message_id, []).append((callback, fields, subset))
+
+    def unsubscribe(self, message_id, callback):
+        handlers = [handler for handler in self.handlers.get(message_id, []) if handler[0] != callback]
+        if handlers:
+            self.handlers[message_id] = handlers
+        else:
+            self.handlers.pop(message_id, None)
+
+    def dispatch(self, packet):
+        handlers = self.handlers.get(packet.message_id)
+        probe = self.probe
+        if probe is not None:
+            probe.packet(packet.message_id)
+        if not handlers:
+            self.unhandled_packet_count += 1
+            return
+        for callback, fields, subset in handlers:
+            if probe is None:
+                callback(packet, self.handler_message(packet, fields, subset))
+            else:
+                start = perf_counter()
+                message = self.handler_message(packet, fields, subset)
+                probe.decoded(packet.message_id, perf_counter() - start)
+                callback(packet, message)
+
+    def handler_message(self, packet, fields, subset):
+        if fields is None:
+            return packet.message
+        if subset is not None:
+            return self.decoder.decode(packet, subset)
+        message = packet.message
+        return {name: message[name] for name in fields if name in message}
+
     def create_message_packet(self, message_id, message_data, src_addr, dst_addr):
         output = bytearray()
         output.extend(struct.pack('B', self.expected_sync_0))
@@ -82,11 +159,9 @@ class Parser:
         return output
 
     def compute_checksum(self, data):
-        chk_a = 0
-        chk_b = 0
-        for i in data:
-            chk_a = (chk_a + i) % 256
-            chk_b = (chk_b + chk_a) % 256
+        # chk_a is the byte sum, chk_b the sum of the running chk_a values
+        chk_a = sum(data) % 256
+        chk_b = sum(accumulate(data)) % 256
         output = bytearray([chk_a, chk_b])
         return output
 
@@ -97,6 +172,83 @@ class Parser:
         else:
             return False
 
+    def feed(self, buffer):
+        # Frame every complete packet in buffer. Bytes of a packet that is
+        # cut off at the end of the buffer are kept for the next call. The
+        # error counters advance exactly as if each byte went through parse().
+        if self.feed_pending:
+            buf = self.feed_pending + bytes(buffer)
+        elif isinstance(buffer, (bytes, bytearray)):
+            buf = buffer
+        else:
+            buf = bytes(buffer)
+        view = memoryview(buf)
+        end = len(buf)
+        packets = []
+        pos = 0
+        synced = self.feed_synced
+
+        while pos < end:
+            if synced:
+                synced = False
+                if buf[pos] != self.expected_sync_0:
+                    self.sync_error_count += 1
+                    pos += 1
+                    continue
+                start = pos
+            else:
+                start = buf.find(b'\x76', pos)
+                if start < 0:
+                    pos = end
+                    break
+
+            if start + 1 >= end:
+                pos = start
+                break
+            if buf[start + 1] != self.expected_sync_1:
+                self.sync_error_count += 1
+                pos = start + 2
+                continue
+
+            header_end = start + 8
+            if header_end > end:
+                pos = start
+                break
+            dst_addr, src_addr, message_id, length = self.header_struct.unpack_from(
+                buf, start + 2)
+            if length > self.payload_size_max:
+                self.constraints_error_count += 1
+                pos = header_end
+                continue
+
+            packet_end = header_end + length + 2
+            if packet_end > end:
+                pos = start
+                break
+            checked = view[start + 2:header_end + length]
+            if sum(checked) % 256 != buf[packet_end - 2]:
+                self.checksum_error_count += 1
+                pos = packet_end - 1
+                continue
+            if sum(accumulate(checked)) % 256 != buf[packet_end - 1]:
+                self.checksum_error_count += 1
+                pos = packet_end
+                continue
+
+            packet = Parser.Packet(src_addr, dst_addr, message_id,
+                                   view[header_end:header_end + length], self.decoder)
+            packets.append(packet)
+            self.correct_message_count += 1
+            self.dispatch(packet)
+            pos = packet_end
+            synced = True
+
+        self.feed_pending = bytes(buf[pos:])
+        self.feed_synced = synced
+        if self.probe is not None:
+            self.probe.fed(len(buffer))
+        return packets
+
     def parse(self, incoming_byte):
         self.current_byte = incoming_byte[0]
         func = self.switcher.get(
@@ -157,7 +309,6 @@ class Parser:
             self.constraints_error_count += 1
             self.state = Parser.States.none
         else:
-            self.packet_working.data = bytearray()
             self.data_length = 0
             if self.length > 0:
                 self.state = Parser.States.data
@@ -167,7 +318,7 @@ class Parser:
     def parse_data(self):
         self.chk_a = (self.chk_a + self.current_byte) % 256
         self.chk_b = (self.chk_b + self.chk_a) % 256
-        self.packet_working.data.append(self.current_byte)
+        self.payload_buffer[self.data_length] = self.current_byte
         self.data_length += 1
         if self.data_length == self.length:
             self.state = Parser.States.chka
@@ -181,12 +332,16 @@ class Parser:
 
     def parse_chkb(self):
         if self.chk_b == self.current_byte:
+            # Hand out the finished packet and start a new one, since the
+            # message is decoded later from the packet's own data
             self.packet_finished = self.packet_working
-            self.packet_finished.message = self.decoder.decode(
-                self.packet_finished)
+            self.packet_finished.data = bytes(self.payload_buffer[:self.length])
+            self.packet_finished.decoder = self.decoder
+            self.packet_working = Parser.Packet()
             self.packet_ready = True
             self.correct_message_count += 1
             self.state = Parser.States.sync0
+            self.dispatch(self.packet_finished)
         else:
             self.checksum_error_count += 1
             self.state = Parser.States.none
@@ -0,0 +1,193 @@
+import argparse
+import os
+import random
+import socket
+import sys
+import time
+import serial
+import VACSParser
+
+
+class Replayer:
+
+    # Replays a recorded VACS byte stream (e.g. plane_10.dat) packet by
+    # packet. The log is framed once with Parser.feed(); bytes between valid
+    # packets are not replayed. Packets are written in batches of at least
+    # batch_size bytes, either as fast as the output takes them (speed=None)
+    # or paced to the time they take on a baudrate 8N1 line, scaled by speed.
+    #
+    # Fault injection, per packet and from a seeded generator so a run can
+    # be repeated: corrupt_rate flips a bit of chk_b, drop_sync_rate leaves
+    # out the first sync byte.
+
+    bits_per_byte = 10
+
+    def __init__(self, log_path, message_definition_path, message_ids=None, exclude_ids=None,
+                 corrupt_rate=0.0, drop_sync_rate=0.0, seed=None):
+        parser = VACSParser.Parser(message_definition_path)
+        with open(log_path, 'rb') as log_file:
+            packets = parser.feed(log_file.read())
+        self.packets = []
+        for packet in packets:
+            if message_ids is not None and packet.message_id not in message_ids:
+                continue
+            if exclude_ids is not None and packet.message_id in exclude_ids:
+                continue
+            header = parser.header_struct.pack(packet.dst_addr, packet.src_addr,
+                                               packet.message_id, len(packet.data))
+            body = header + bytes(packet.data)
+            self.packets.append(b'\x76\x63' + body + bytes(parser.compute_checksum(body)))
+        self.log_bytes = sum(len(packet) for packet in self.packets)
+        self.corrupt_rate = corrupt_rate
+        self.drop_sync_rate = drop_sync_rate
+        self.random = random.Random(seed)
+        self.sent_packets = 0
+        self.sent_bytes = 0
+        self.writes = 0
+        self.corrupted = 0
+        self.dropped_sync = 0
+        self.elapsed = 0.0
+
+    def faulty(self, packet):
+        if self.corrupt_rate and self.random.random() < self.corrupt_rate:
+            packet = packet[:-1] + bytes([packet[-1] ^ 0x01])
+            self.corrupted += 1
+        if self.drop_sync_rate and self.random.random() < self.drop_sync_rate:
+            packet = packet[1:]
+            self.dropped_sync += 1
+        return packet
+
+    def batches(self, batch_size):
+        batch = bytearray()
+        count = 0
+        for packet in self.packets:
+            if self.corrupt_rate or self.drop_sync_rate:
+                packet = self.faulty(packet)
+            batch.extend(packet)
+            count += 1
+            if len(batch) >= batch_size:
+                yield batch, count
+                batch = bytearray()
+                count = 0
+        if batch:
+            yield batch, count
+
+    def run(self, write, baudrate=57600, speed=1.0, loops=1, batch_size=1, report=None):
+        # loops=0 replays until interrupted. report(replayer) is called about
+        # once a second.
+        byte_time = None if speed is None else Replayer.bits_per_byte / (baudrate * speed)
+        start = time.perf_counter()
+        next_report = start + 1.0
+        wire_bytes = 0
+        loop = 0
+        while self.packets and (loops == 0 or loop < loops):
+            loop += 1
+            for batch, count in self.batches(batch_size):
+                if byte_time is not None:
+                    # A batch goes out when the line would have finished the
+                    # previous one
+                    delay = start + wire_bytes * byte_time - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                write(bytes(batch))
+                wire_bytes += len(batch)
+                self.sent_bytes += len(batch)
+                self.sent_packets += count
+                self.writes += 1
+                if report is not None and time.perf_counter() >= next_report:
+                    next_report += 1.0
+                    self.elapsed = time.perf_counter() - start
+                    report(self)
+        self.elapsed = time.perf_counter() - start
+
+    def __str__(self):
+        rate = self.sent_bytes / self.elapsed if self.elapsed > 0 else 0.0
+        return ("Replayer(packets=" + str(self.sent_packets) + ",bytes=" + str(self.sent_bytes) +
+                ",writes=" + str(self.writes) + ",corrupted=" + str(self.corrupted) +
+                ",dropped_sync=" + str(self.dropped_sync) + ",bytes_per_s=" + format(rate, '.0f') +
+                ",x_realtime=" + format(rate * Replayer.bits_per_byte / 57600, '.1f') + ")")
+
+
+def open_output(destination, baudrate=57600):
+    # Returns (write, close). destination is a serial port, 'pty' for a new
+    # pseudo terminal whose name is printed, or tcp:[host:]port to serve one
+    # client (VACSTransport.open_connection can connect to it).
+    if destination == 'pty':
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        print("Replaying to", os.ttyname(slave))
+
+        def write(data):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(master, view):]
+
+        def close():
+            os.close(master)
+            os.close(slave)
+        return write, close
+
+    if destination.startswith('tcp:'):
+        host, _, port = destination[4:].rpartition(':')
+        # socket.create_server needs Python 3.8
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host or '127.0.0.1', int(port)))
+        server.listen(1)
+        print("Waiting for a connection on", destination)
+        connection, address = server.accept()
+        server.close()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def close():
+            connection.close()
+        return connection.sendall, close
+
+    port = serial.Serial(destination, baudrate)
+    return port.write, port.close
+
+
+def message_id_list(text):
+    return set(int(message_id) for message_id in text.split(','))
+
+
+def main(argv):
+    arguments = argparse.ArgumentParser(description="Replay a recorded VACS log")
+    arguments.add_argument('log')
+    arguments.add_argument('destination', help="serial port, 'pty' or tcp:[host:]port")
+    arguments.add_argument('message_definition_path', nargs='?',
+                           default='FCSPlaneDefinition_Aries_FCS.xml')
+    arguments.add_argument('--baudrate', type=int, default=57600)
+    pacing = arguments.add_mutually_exclusive_group()
+    pacing.add_argument('--speed', type=float, default=1.0,
+                        help="multiple of the baud rate to pace at (default 1)")
+    pacing.add_argument('--fast', action='store_true', help="no pacing")
+    arguments.add_argument('--loops', type=int, default=1, help="0 replays forever")
+    arguments.add_argument('--batch', type=int, default=1,
+                           help="minimum bytes per write (default: one packet)")
+    arguments.add_argument('--only', type=message_id_list, help="comma separated message ids")
+    arguments.add_argument('--exclude', type=message_id_list, help="comma separated message ids")
+    arguments.add_argument('--corrupt', type=float, default=0.0,
+                           help="fraction of packets with a bad checksum")
+    arguments.add_argument('--drop-sync', type=float, default=0.0,
+                           help="fraction of packets missing their first sync byte")
+    arguments.add_argument('--seed', type=int)
+    options = arguments.parse_args(argv)
+
+    replayer = Replayer(options.log, options.message_definition_path, options.only,
+                        options.exclude, options.corrupt, options.drop_sync, options.seed)
+    print("Loaded", len(replayer.packets), "packets,", replayer.log_bytes, "bytes")
+    write, close = open_output(options.destination, options.baudrate)
+    try:
+        replayer.run(write, options.baudrate, None if options.fast else options.speed,
+                     options.loops, options.batch, report=print)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
+    print(replayer)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,257 @@
+import asyncio
+import os
+import sys
+import serial
+import VACSEncoder
+import VACSParser
+
+
+class Link:
+
+    # One VACS link on an asyncio event loop. Incoming bytes are read in
+    # chunks and framed with parser.feed(); subscribers registered on the
+    # parser are called as packets arrive, and every packet is also put on
+    # a bounded queue for async consumers. When the queue is full the link
+    # stops reading, so the OS buffer (and the sender) absorbs the backlog.
+    # Outgoing packets are coalesced and written at most once per
+    # flush_interval.
+
+    def __init__(self, parser, reader, writer, queue_size=256, chunk_size=4096,
+                 flush_interval=0.005, name=''):
+        self.parser = parser
+        self.reader = reader
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.packets = asyncio.Queue(queue_size) if queue_size else None
+        self.outgoing = bytearray()
+        self.encoder = VACSEncoder.Encoder(parser.decoder)
+        self.outgoing_ready = asyncio.Event()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reads = 0
+        self.writes = 0
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [
+            asyncio.ensure_future(self.receive_loop()),
+            asyncio.ensure_future(self.transmit_loop()),
+        ]
+        return self
+
+    async def receive_loop(self):
+        while True:
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                break
+            self.bytes_in += len(chunk)
+            self.reads += 1
+            packets = self.parser.feed(chunk)
+            if self.packets is not None:
+                for packet in packets:
+                    await self.packets.put(packet)
+        if self.packets is not None:
+            await self.packets.put(None)
+
+    async def transmit_loop(self):
+        while True:
+            await self.outgoing_ready.wait()
+            if self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            self.outgoing_ready.clear()
+            data = bytes(self.outgoing)
+            del self.outgoing[:]
+            self.writer.write(data)
+            self.bytes_out += len(data)
+            self.writes += 1
+            await self.writer.drain()
+
+    def send(self, message_id, message_data, src_addr, dst_addr):
+        self.send_bytes(self.parser.create_message_packet(
+            message_id, message_data, src_addr, dst_addr))
+
+    def send_many(self, packets):
+        # (message_id, message_data, src_addr, dst_addr) tuples packed into
+        # one buffer, e.g. a mission upload
+        self.send_bytes(self.encoder.encode(packets))
+
+    def send_bytes(self, data):
+        self.outgoing.extend(data)
+        self.outgoing_ready.set()
+
+    async def get(self):
+        # Next packet, or None once the link has been closed by the far end
+        return await self.packets.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        packet = await self.packets.get()
+        if packet is None:
+            raise StopAsyncIteration
+        return packet
+
+    async def close(self):
+        if self.outgoing:
+            self.writer.write(bytes(self.outgoing))
+            del self.outgoing[:]
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.writer.close()
+
+
+class ThreadedSerial:
+
+    # Reader/writer pair for serial ports that cannot be polled by the event
+    # loop (Windows). Blocking calls run in the default executor and the
+    # read timeout keeps the thread from spinning.
+
+    def __init__(self, port):
+        self.port = port
+        self.port.timeout = 0.1
+
+    async def read(self, size):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read_blocking, size)
+
+    def read_blocking(self, size):
+        while self.port.is_open:
+            data = self.port.read(min(size, max(1, self.port.in_waiting)))
+            if data:
+                return data
+        return b''
+
+    def write(self, data):
+        self.port.write(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.port.close()
+
+
+class PortWriter:
+
+    # StreamWriter wrapper that also closes the serial port it writes to
+
+    def __init__(self, writer, port):
+        self.writer = writer
+        self.port = port
+
+    def write(self, data):
+        self.writer.write(data)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+        self.port.close()
+
+
+async def open_serial(path, parser, baudrate=57600, **kwargs):
+    # Serial port or pty. pyserial only configures the line; reads and
+    # writes go through the event loop on duplicates of its descriptor.
+    port = serial.Serial(path, baudrate, timeout=0)
+    if not hasattr(port, 'fileno') or os.name == 'nt':
+        threaded = ThreadedSerial(port)
+        return Link(parser, threaded, threaded, name=path, **kwargs).start()
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    read_file = os.fdopen(os.dup(port.fileno()), 'rb', buffering=0)
+    write_file = os.fdopen(os.dup(port.fileno()), 'wb', buffering=0)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), read_file)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, write_file)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return Link(parser, reader, PortWriter(writer, port), name=path, **kwargs).start()
+
+
+async def open_connection(host, port, parser, **kwargs):
+    # TCP stand-in for a radio, e.g. a socat bridge or a log replayer
+    reader, writer = await asyncio.open_connection(host, port)
+    return Link(parser, reader, writer, name=host + ':' + str(port), **kwargs).start()
+
+
+class DatagramStream(asyncio.DatagramProtocol):
+
+    # Reader/writer pair over UDP: datagrams are appended to a StreamReader
+    # in arrival order and replies go to whoever sent the last datagram,
+    # e.g. a radio modem bridged to UDP
+
+    def __init__(self):
+        self.reader = asyncio.StreamReader()
+        self.transport = None
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.peer = address
+        self.reader.feed_data(data)
+
+    def connection_lost(self, exc):
+        self.reader.feed_eof()
+
+    async def read(self, size):
+        return await self.reader.read(size)
+
+    def write(self, data):
+        if self.peer is not None:
+            self.transport.sendto(data, self.peer)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.transport.close()
+
+
+async def open_udp(host, port, parser, **kwargs):
+    # Listen for VACS datagrams on host:port
+    loop = asyncio.get_running_loop()
+    transport, stream = await loop.create_datagram_endpoint(DatagramStream, local_addr=(host, port))
+    return Link(parser, stream, stream, name='udp:' + host + ':' + str(port), **kwargs).start()
+
+
+async def periodic(interval, callback):
+    # Run callback every interval seconds on the loop's clock
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        deadline += interval
+        await asyncio.sleep(max(0, deadline - loop.time()))
+        callback()
+
+
+async def main(fc_path, gs_path, message_definition_path):
+    fc_link = await open_serial(fc_path, VACSParser.Parser(message_definition_path), queue_size=None)
+    gs_link = await open_serial(gs_path, VACSParser.Parser(message_definition_path), queue_size=None)
+
+    def report():
+        for link in (fc_link, gs_link):
+            print(link.name, "bytes_in:", link.bytes_in, "reads:", link.reads,
+                  "packets:", link.parser.correct_message_count,
+                  "checksum_errors:", link.parser.checksum_error_count)
+
+    try:
+        await periodic(1.0, report)
+    finally:
+        await fc_link.close()
+        await gs_link.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print("Usage: python VACSTransport.py fc-serial-port gs-serial-port message-definition-path")
+        sys.exit(1)
+    try:
+        asyncio.run(main(sys.argv[1], sys.argv[2], sys.argv[3]))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,244 @@
+import queue
+import threading
+import time
+
+
+class StageStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.dropped = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        # Metrics.Histogram once the pipeline is instrumented
+        self.histogram = None
+
+    def record(self, latency):
+        with self.lock:
+            self.count += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+            if self.histogram is not None:
+                self.histogram.record(latency)
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def error(self, error):
+        # A failing stage can fail on every frame; print the 1st, 10th,
+        # 100th, ... error rather than all of them
+        with self.lock:
+            self.errors += 1
+            errors = self.errors
+        if errors == 10 ** (len(str(errors)) - 1):
+            print(self.name + ": error " + str(errors) + ": " + repr(error))
+
+    def mean_latency(self):
+        return self.total_latency / self.count if self.count else 0.0
+
+    def __str__(self):
+        return (self.name + "(count=" + str(self.count) + ",dropped=" + str(self.dropped) +
+                ",errors=" + str(self.errors) +
+                ",mean_ms=" + format(self.mean_latency() * 1000, '.1f') +
+                ",max_ms=" + format(self.max_latency * 1000, '.1f') + ")")
+
+
+class Frame:
+
+    def __init__(self, frame_id, capture_time, image):
+        self.frame_id = frame_id
+        self.capture_time = capture_time
+        self.image = image
+        self.detections = None
+        self.pose = None
+        self.targets = []
+        self.unlocated = []
+
+
+class LatestFrame:
+
+    # Single-slot mailbox between capture and detection. A frame that is
+    # replaced before anyone took it is counted as dropped.
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+
+    def put(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.stats.drop()
+            self.frame = frame
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while self.frame is None and not self.closed:
+                self.condition.wait()
+            frame = self.frame
+            self.frame = None
+            return frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class Sink:
+
+    # Consumer of detected frames on its own thread. offer() never blocks;
+    # a frame that does not fit in the queue is dropped and counted. A sink
+    # with needs_detection=False (e.g. a display) also gets the frames the
+    # governor turned away, with no detections.
+
+    def __init__(self, name, handler, queue_size=4, needs_detection=True):
+        self.handler = handler
+        self.needs_detection = needs_detection
+        self.queue = queue.Queue(queue_size)
+        self.stats = StageStats(name)
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def offer(self, frame):
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.stats.drop()
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            try:
+                self.handler(frame)
+            except Exception as error:
+                # One bad frame (or a broken display) must not stop the sink
+                self.stats.error(error)
+                continue
+            # End-to-end: capture to the sink being done with the frame
+            self.stats.record(time.time() - frame.capture_time)
+
+    def stop(self):
+        # Only wait for queue space while the thread is alive to drain it
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+
+class Pipeline:
+
+    # capture thread -> LatestFrame -> detector workers -> sinks
+    #
+    # The capture thread reads as fast as the camera delivers and only the
+    # newest frame is kept, so a slow detector drops frames instead of
+    # delaying them. OpenCV releases the GIL while it works, so several
+    # detector threads use several cores. annotate(frame), if given, runs
+    # on the detector thread after detect and before the sinks see the frame.
+    # A governor (see Governor.py) may turn frames away before detection;
+    # those frames only reach the sinks that do not need detection.
+
+    def __init__(self, capture, detect, sinks, workers=2, annotate=None, governor=None):
+        self.capture = capture
+        self.detect = detect
+        self.annotate = annotate
+        self.governor = governor
+        self.sinks = sinks
+        self.capture_stats = StageStats('capture')
+        self.detect_stats = StageStats('detect')
+        self.mailbox = LatestFrame(self.capture_stats)
+        self.running = False
+        self.frame_count = 0
+        self.threads = [threading.Thread(target=self.capture_loop, name='capture', daemon=True)]
+        for i in range(workers):
+            self.threads.append(threading.Thread(
+                target=self.detect_loop, name='detect' + str(i), daemon=True))
+
+    def start(self):
+        self.running = True
+        for sink in self.sinks:
+            sink.thread.start()
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        # Safe to call from any stage, including a sink
+        self.running = False
+        self.mailbox.close()
+
+    def join(self):
+        # Wait for capture to end (stop() or camera failure), then let the
+        # sinks finish what they have queued
+        for thread in self.threads:
+            thread.join()
+        for sink in self.sinks:
+            sink.stop()
+        for sink in self.sinks:
+            sink.thread.join()
+
+    def capture_loop(self):
+        while self.running:
+            start = time.time()
+            ok, image = self.capture.read()
+            if not ok:
+                break
+            capture_time = time.time()
+            self.capture_stats.record(capture_time - start)
+            self.frame_count += 1
+            self.mailbox.put(Frame(self.frame_count, capture_time, image))
+        self.mailbox.close()
+
+    def detect_loop(self):
+        while True:
+            frame = self.mailbox.get()
+            if frame is None:
+                break
+            if self.governor is not None and not self.governor.admit(frame):
+                frame.detections = []
+                for sink in self.sinks:
+                    if not sink.needs_detection:
+                        sink.offer(frame)
+                continue
+            start = time.time()
+            try:
+                frame.detections = self.detect(frame.image)
+                if self.governor is not None:
+                    self.governor.done(time.time() - start)
+                if self.annotate is not None:
+                    self.annotate(frame)
+            except Exception as error:
+                self.detect_stats.error(error)
+                continue
+            self.detect_stats.record(time.time() - start)
+            for sink in self.sinks:
+                sink.offer(frame)
+
+    def instrument(self, registry):
+        # Stage latency histograms plus counts, drops and sink queue depths
+        # as gauges in a Metrics.Registry
+        for stats in self.stats()[0]:
+            name = 'vision/' + stats.name
+            stats.histogram = registry.histogram(name + '/latency')
+            registry.gauge(name + '/count', lambda stats=stats: stats.count)
+            registry.gauge(name + '/dropped', lambda stats=stats: stats.dropped)
+            registry.gauge(name + '/errors', lambda stats=stats: stats.errors)
+        for sink in self.sinks:
+            registry.gauge('vision/' + sink.stats.name + '/queue', sink.queue.qsize)
+
+    def stats(self):
+        stages = [self.capture_stats, self.detect_stats] + [sink.stats for sink in self.sinks]
+        depths = {sink.stats.name: sink.queue.qsize() for sink in self.sinks}
+        return stages, depths
@@ -1,11 +1,18 @@
 import cv2
 import threading
 
-import os
 import serial
-import imutils
 import sys
 import VACSParser
+import Detector
+import Governor
+import ImageStore
+import Metrics
+import TelemetryBuffer
+import TelemetryRecorder
+import TargetDownlink
+import TargetStore
+import VisionPipeline
 import time
 from msvcrt import kbhit, getch
 
@@ -33,100 +40,141 @@ gscomtopi = serial.Serial(str(gscomport), baudrate=57600,)
 fccomport = serial.Serial(str(fccomport), baudrate=57600,)
 message_definition_path = message_definition_path
 parser = VACSParser.Parser(message_definition_path)
-Altitude = 0.00
-Latitude = 'wrong'
-Longitude = 'wrong '
-objectdist = 0
+telemetry = TelemetryBuffer.TelemetryBuffer()
+# every fixed-layout FC message, compressed into telemetry/ for after landing
+recorder = TelemetryRecorder.Recorder(parser, 'telemetry')
+# VACS address of this vision computer; the station id when it is numeric
+vision_address = int(stid) if stid.isdigit() else 2
+downlink = TargetDownlink.TargetDownlink(parser, gscomtopi.write, vision_address)
 tentWidth = 20
 focalLength = 415.15
 
-def dis_to_camera(Width, focalLength, perWidth):
-    # compute and return the distance from the maker to the camer
-    return (Width * focalLength) / perWidth
+detector = Detector.Detector(tentWidth, focalLength)
+# follow targets in a small window, full coarse-to-fine search every 15 frames
+tracker = Detector.Tracker(detector, full_every=15)
+# positive/ and negative/ in the working directory, capped at 2 GB
+image_store = ImageStore.ImageStore('.', max_bytes=2 * 1024 ** 3, negative_every=30)
+# skip frames on the ground, too high to see a tent, repeated, or over
+# half a core of detection time
+governor = Governor.Governor(lambda t: telemetry.pose(t).get('position/altitude'),
+                             tentWidth, focalLength, cpu_budget=0.5)
+# detections within 10 m of each other are the same target
+targets = TargetStore.TargetStore(merge_radius=10.0, update_distance=5.0)
+
 
 def getFCdata():
     print('Running FC')
-    global Latitude
-    global Longitude
-    global Altitude
+    # Only position and attitude are decoded; the recorder copies the raw
+    # payloads of the other messages
+    telemetry.subscribe(parser)
     while 1:
-        byte = fccomport.read(1)
-        if byte:
-            parser.parse(byte)
-            newbyte = parser.get_packet()
-            if newbyte:
-                for i in newbyte.message:
-                    #print(i, newbyte.message[i], newbyte.message_id)
-                    if newbyte.message_id == 1:
-                        Longitude = str(newbyte.message['position/longitude'])
-                        print("Longitube: "+str(Longitude))
-                        Latitude = str(newbyte.message[i])
-                        print("Latitude: "+str(Latitude))
-                        Altitude = float(newbyte.message['position/altitude'])
-                        print("Altitude: "+str(Altitude)) #  getFCdata()
+        chunk = fccomport.read(fccomport.in_waiting or 1)
+        if chunk:
+            parser.feed(chunk)
             if kbhit():
                 break
 
 
+def detect_frame(img):
+    detections = tracker.detect(img)
+    Detector.draw_detections(img, detections)
+    return detections
+
+
+def locate_frame(frame):
+    # Runs on the detector thread: tag the frame with its pose and merge its
+    # detections into the target store. frame.targets only lists targets
+    # that are new or have moved, so the sinks skip repeat sightings.
+    # Detections that cannot be placed (no position report yet) go to
+    # frame.unlocated and are saved and reported without a position.
+    frame.pose = telemetry.pose(frame.capture_time)
+    for detection in frame.detections:
+        latitude, longitude = TargetStore.target_position(
+            frame.pose, detection, frame.image.shape, focalLength)
+        if latitude is None:
+            frame.unlocated.append(detection)
+            continue
+        target, event = targets.add(latitude, longitude, frame.capture_time, detection.distance)
+        if event is not None:
+            frame.targets.append((target, event))
+
+
+def save_frame(frame):
+    # Frames whose every detection merged into a known target are repeats
+    if frame.detections and not frame.targets and not frame.unlocated:
+        return
+    image_store.submit(frame.image, bool(frame.detections), {
+        'time': frame.capture_time,
+        'frame_id': frame.frame_id,
+        'latitude': frame.pose.get('position/latitude'),
+        'longitude': frame.pose.get('position/longitude'),
+        'altitude': frame.pose.get('position/altitude'),
+        'distances': [detection.distance for detection in frame.detections],
+        'targets': [target.target_id for target, event in frame.targets],
+    })
+
+
+def report_frame(frame):
+    for target, event in frame.targets:
+        downlink.report(target.target_id, frame.capture_time, target.latitude, target.longitude,
+                        frame.pose.get('position/altitude'), target.distance,
+                        hits=target.hits, new=event == 'new')
+    # Unplaced detections use the ids above the target store's range
+    for i, detection in enumerate(frame.unlocated[:0x10000 - TargetStore.id_limit]):
+        downlink.report(0xFFFF - i, frame.capture_time, None, None,
+                        frame.pose.get('position/altitude'), detection.distance, new=True)
+
+
+def show_frame(frame):
+    cv2.imshow('img', frame.image)
+    if cv2.waitKey(1) & 0xFF == ord('q'):
+        cv2.destroyAllWindows()
+        pipeline.stop()
+
+
 def find_whiterec_fame():
-    global vcap
-    global Longitude
-    global Latitude
-    global Altitude
-    global objectdist
-    global focalLength
-    while 1:
-        _, img = vcap.read()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        #blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        thresh = cv2.threshold(gray, 235, 255, cv2.THRESH_BINARY)[1]
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = cnts[0] if imutils.is_cv2() else cnts[1]
-        for c in cnts:
-            M = cv2.moments(c)
-            peri = cv2.arcLength(c, True)
-            approx = cv2.approxPolyDP(c, 0.14 * peri, True)
-            area = cv2.contourArea(c)
-            if len(approx) == 4:
-                (x, y, w, h) = cv2.boundingRect(approx)
-                r = w / float(h) # 1500 is arbitrary for this purpose its the area of the larget object on test image / 2
-                if area > 1500 and r >= 0.65 and r <= 1.35:
-                    cv2.drawContours(img, [c], -1, (0, 255, 0), 2)
-                    marker = cv2.minAreaRect(c)
-                    #if frun == True:
-                    #    self.focalLength = (marker[1][0] * self.Altitude) / self.tentWidth
-                    #    self.frun = False
-                    objectdist = dis_to_camera(tentWidth, focalLength, marker[1][0])
-                    comtogs(Altitude,Longitude,Latitude,objectdist)
-                    handleimg(img, 1, Longitude)
-            else:
-                handleimg(img, 0, str(time.time()))
-        cv2.imshow('img', img)
-        #cv2.imshow('img2', gray)
-        #cv2.imshow('img3', thresh)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            cv2.destroyAllWindows()
-            break
+    # capture -> detect -> (disk, ground station, display); see VisionPipeline
+    pipeline.start()
+    pipeline.join()
+    image_store.close()
+    downlink.stop()
+    for stage in pipeline.stats()[0]:
+        print(stage)
+    print(image_store)
+    print(downlink)
+    print(targets)
+    print(governor)
+    recorder.close()
+    print(recorder)
+    if metrics_reporter is not None:
+        metrics_reporter.stop()
     vcap.release()
 
 
-def handleimg(image, xint, name):
-    if xint == 1:
-        if not os.path.exists('positive'):
-            os.makedirs('positive')
-        cv2.imwrite("positive/img"+name+".jpg", image)
-    elif xint == 0:
-        if not os.path.exists('negative'):
-            os.makedirs('negative')
-        name = time.time() * 1000
-        cv2.imwrite("negative/img"+str(name)+".jpg", image)
-def comtogs(alt, lon, lat,dist):
-    data = 'Altitude: '+str(alt)+'-'+'Latitude: '+lat+'-'+'Longitube: '+lon+'-'+'Distance: '+str(dist)+'\n'
-    data = data.encode()
-    gscomtopi.write(data)
+pipeline = VisionPipeline.Pipeline(vcap, detect_frame, [
+    VisionPipeline.Sink('disk', save_frame),
+    VisionPipeline.Sink('telemetry', report_frame),
+    # the display also shows frames the governor skipped, so 'q' always works
+    VisionPipeline.Sink('display', show_frame, queue_size=1, needs_detection=False),
+], annotate=locate_frame, governor=governor)
+
+# Runtime metrics only when VACS_METRICS names a file or unix:<socket path>
+metrics, metrics_reporter = Metrics.from_environment()
+if metrics is not None:
+    Metrics.ParserProbe(metrics, parser, 'fc')
+    pipeline.instrument(metrics)
+    image_store.instrument(metrics)
+    metrics.gauge('downlink/sent', lambda: downlink.sent)
+    metrics.gauge('downlink/pending', lambda: len(downlink.pending))
+    metrics.gauge('targets/count', lambda: len(targets))
+    metrics.gauge('governor/processed', lambda: governor.processed)
+    for reason in Governor.Governor.reasons:
+        metrics.gauge('governor/' + reason, lambda reason=reason: governor.skipped[reason])
+    metrics_reporter.start()
 
 try:
     print('Author Papa Beye\nVIP Image Proccessing 2018\nDr. Klenke  & Andy Fabian')
+    downlink.start()
     t = threading.Thread(target=getFCdata)
     t2 = threading.Thread(target=find_whiterec_fame)
     t.start()
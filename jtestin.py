@@ -1,13 +1,25 @@
 import serial
-gscomtopi = serial.Serial('COM4', 57600)
+import sys
+import VACSParser
+
+serial_port_path = sys.argv[1] if len(sys.argv) > 1 else 'COM4'
+message_definition_path = sys.argv[2] if len(sys.argv) > 2 else 'FCSPlaneDefinition_Aries_FCS.xml'
+
+gscomtopi = serial.Serial(serial_port_path, 57600, timeout=0.5)
+parser = VACSParser.Parser(message_definition_path)
 
-while True:
-    if gscomtopi.inWaiting() > 0:
-        data = gscomtopi.readline()
-        data = data.decode()
-        data = data.replace('-', '\n')
-        print(data)
-    
 
+def print_target(packet, message):
+    if message:
+        print("Target " + str(message['target/id']) + " from " + str(packet.src_addr) +
+              (" (new)" if message['target/flags'] & 1 else ""))
+        print("Altitude: " + str(message['target/altitude']))
+        print("Latitude: " + str(message['target/latitude']))
+        print("Longitude: " + str(message['target/longitude']))
+        print("Distance: " + str(message['target/distance']))
 
 
+parser.subscribe(parser.get_message_id('Target Report'), print_target)
+
+while True:
+    parser.feed(gscomtopi.read(gscomtopi.in_waiting or 1))
@@ -1,11 +1,5 @@
-import serial
-
-import time
-gscomtopi = serial.Serial('COM2', 57600)
-
-file = open('plane_10.dat','rb')
-
-while True:
-    data = file.read(1)
-    gscomtopi.write(data)
+import VACSReplay
 
+# Replay plane_10.dat to COM2 forever at the real 57600 baud rate; see
+# VACSReplay.py for faster replay, filters and fault injection
+VACSReplay.main(['plane_10.dat', 'COM2', '--loops', '0'])